@@ -0,0 +1,115 @@
+"""
+Admission control cho các endpoint inference (giới hạn theo từng worker)
+- Tối đa `max_inflight` request chạy đồng thời, các request khác chờ trong hàng đợi có giới hạn
+- Hàng đợi đầy hoặc chờ quá `queue_timeout` -> từ chối ngay (503 + Retry-After)
+- Nhiều lane ưu tiên: lane đứng trước trong `lanes` luôn được nhận slot trống trước
+"""
+import threading
+import time
+
+import metrics
+
+
+DEFAULT_LANES = ('high', 'normal')
+
+
+class Overloaded(Exception):
+    """Request bị từ chối vì worker đang quá tải"""
+
+    def __init__(self, lane, reason):
+        super().__init__(f"Worker quá tải ({lane}: {reason})")
+        self.lane = lane
+        self.reason = reason
+
+
+class AdmissionController:
+    """
+    Giới hạn số request inference đồng thời và số request chờ theo từng lane
+
+    Args:
+        max_inflight: Số request chạy đồng thời tối đa (0 = không giới hạn)
+        queue_size: Số request chờ tối đa cho mỗi lane (0 = không chờ)
+        queue_timeout: Thời gian chờ tối đa (giây) trước khi từ chối
+        lanes: Tên các lane theo thứ tự ưu tiên giảm dần
+    """
+
+    def __init__(self, max_inflight, queue_size=0, queue_timeout=10.0, lanes=DEFAULT_LANES):
+        self.max_inflight = max_inflight
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.lanes = tuple(lanes)
+        self.inflight = 0
+        self.waiting = {lane: 0 for lane in self.lanes}
+        self._cond = threading.Condition()
+
+    @property
+    def enabled(self):
+        return self.max_inflight > 0
+
+    def _has_priority_waiter(self, lane):
+        """Có request đang chờ ở lane ưu tiên cao hơn không"""
+        for other in self.lanes:
+            if other == lane:
+                return False
+            if self.waiting[other]:
+                return True
+        return False
+
+    def _can_run(self, lane):
+        return self.inflight < self.max_inflight and not self._has_priority_waiter(lane)
+
+    def _update_gauges(self):
+        metrics.set_gauge('admission.inflight', self.inflight)
+        for lane, count in self.waiting.items():
+            metrics.set_gauge(f'admission.queue_depth.{lane}', count)
+
+    def _reject(self, lane, reason):
+        metrics.inc(f'admission.rejected.{lane}.{reason}')
+        raise Overloaded(lane, reason)
+
+    def acquire(self, lane):
+        """
+        Nhận một slot cho request (chờ trong hàng đợi nếu cần)
+
+        Raises:
+            Overloaded: Hàng đợi của lane đầy hoặc chờ quá queue_timeout
+        """
+        if not self.enabled:
+            return
+        if lane not in self.waiting:
+            lane = self.lanes[-1]
+
+        start = time.monotonic()
+        with self._cond:
+            if not self._can_run(lane):
+                if self.waiting[lane] >= self.queue_size:
+                    self._reject(lane, 'queue_full')
+
+                self.waiting[lane] += 1
+                self._update_gauges()
+                try:
+                    deadline = start + self.queue_timeout
+                    while not self._can_run(lane):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._reject(lane, 'timeout')
+                        self._cond.wait(remaining)
+                finally:
+                    self.waiting[lane] -= 1
+                    # Lane ưu tiên vừa rời hàng đợi -> các lane sau có thể được chạy
+                    self._cond.notify_all()
+
+            self.inflight += 1
+            self._update_gauges()
+
+        metrics.inc(f'admission.accepted.{lane}')
+        metrics.inc('admission.wait_ms', (time.monotonic() - start) * 1000)
+
+    def release(self):
+        """Trả slot sau khi request hoàn tất"""
+        if not self.enabled:
+            return
+        with self._cond:
+            self.inflight -= 1
+            self._update_gauges()
+            self._cond.notify_all()
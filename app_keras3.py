@@ -3,27 +3,122 @@ Flask Web Application - Nhận diện bệnh răng từ X-quang
 Sử dụng Ensemble Model với CBAM + Focal Loss (Keras 3)
 """
 import os
+import signal
 os.environ['KERAS_BACKEND'] = 'tensorflow'
 
+import hmac
+import json
+import time
+import uuid
 import numpy as np
 import shutil
 import tempfile
-from flask import Flask, render_template, request, redirect, url_for, flash
+from contextlib import ExitStack
+from functools import wraps
+from flask import (Flask, render_template, request, redirect, url_for, flash,
+                   Response, stream_with_context, jsonify, make_response, g, abort)
 from werkzeug.utils import secure_filename
 import keras
-from keras.preprocessing import image
-from keras.applications.mobilenet_v2 import preprocess_input
 from focal_loss import SparseCategoricalFocalLoss
 from custom_layers_keras3 import (KerasMean, KerasMax, channel_attention_module,
                                    spatial_attention_module, cbam_block)
-from image_analyzer import analyze_image_features, classify_severity_level, is_dental_xray
+from image_analyzer import analyze_image_features, classify_severity_level
 from medical_advice import get_medical_advice
+from tta import build_tta_batch, aggregate_tta_probs, MAX_TTA_VIEWS
+from cv_pipeline import submit_cv_stage, submit_feature_stage, warmup_cv_pool, load_model_input
+from cv_pipeline import run_cv_stage as run_cv_stage_inline, run_feature_stage
+from results_store import ResultsStore, compute_image_hash
+from perceptual_hash import NearDuplicateIndex
+from model_registry import ModelRegistry
+from compiled_inference import CompiledPredictor, DEFAULT_BATCH_BUCKETS
+from precision import PRECISIONS, cpu_supports_bfloat16, to_bfloat16
+from graph_preprocess import ImagePreprocess, uint8_input, with_uint8_input
+import tiling
+from admission import AdmissionController, Overloaded
+from profiling import RequestProfiler
+from runtime_guards import ResourceGuard, prune_uploads, tracing_count
+import metrics
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here-change-in-production'
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg'}
+# Test-time augmentation: chỉ chạy khi độ tin cậy của ensemble thấp hơn ngưỡng
+app.config['TTA_ENABLED'] = os.environ.get('TTA_ENABLED', '0') == '1'
+app.config['TTA_NUM_VIEWS'] = min(int(os.environ.get('TTA_NUM_VIEWS', 6)), MAX_TTA_VIEWS)
+app.config['TTA_CONFIDENCE_THRESHOLD'] = float(os.environ.get('TTA_CONFIDENCE_THRESHOLD', 70))
+# Process pool cho CV stage (decode, is_dental_xray, analyze_image_features): None = số core, 0 = tắt
+app.config['CV_POOL_WORKERS'] = (int(os.environ['CV_POOL_WORKERS'])
+                                 if os.environ.get('CV_POOL_WORKERS') else None)
+# SQLite lưu lịch sử kết quả ('' = tắt)
+app.config['RESULTS_DB'] = os.environ.get(
+    'RESULTS_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results.db'))
+# Chu kỳ (giây) kiểm tra file trong models/ để hot-swap (0 = tắt)
+app.config['MODEL_WATCH_INTERVAL'] = float(os.environ.get('MODEL_WATCH_INTERVAL', 30))
+# Ngân sách bộ nhớ cho models (MB, 0 = không giới hạn) và thời gian idle trước khi giải phóng
+# model không dùng thường xuyên như ResNet50 (giây, 0 = không giải phóng)
+app.config['MODEL_MEMORY_BUDGET_MB'] = float(os.environ.get('MODEL_MEMORY_BUDGET_MB', 0))
+app.config['MODEL_IDLE_TIMEOUT'] = float(os.environ.get('MODEL_IDLE_TIMEOUT', 600))
+# Forward pass biên dịch bằng XLA (jit_compile) cho từng kích thước batch cố định
+app.config['XLA_ENABLED'] = os.environ.get('XLA_ENABLED', '0') == '1'
+app.config['XLA_BATCH_BUCKETS'] = tuple(
+    int(bucket) for bucket in os.environ.get(
+        'XLA_BATCH_BUCKETS', ','.join(map(str, DEFAULT_BATCH_BUCKETS))).split(','))
+# Độ chính xác khi inference: 'float32' hoặc 'bfloat16' (chỉ dùng khi CPU hỗ trợ AVX-512 BF16/AMX)
+app.config['INFERENCE_PRECISION'] = os.environ.get('INFERENCE_PRECISION', 'float32')
+BF16_SUPPORTED = cpu_supports_bfloat16()
+if app.config['INFERENCE_PRECISION'] == 'bfloat16' and not BF16_SUPPORTED:
+    print("⚠ CPU không hỗ trợ bfloat16 (avx512_bf16/amx_bf16), dùng float32")
+    metrics.record_event('precision_fallback', requested='bfloat16', used='float32')
+    app.config['INFERENCE_PRECISION'] = 'float32'
+
+# Ảnh toàn cảnh độ phân giải cao: chia tile 224x224 chồng lấn, chạy cả batch qua ensemble
+# Áp dụng khi cạnh dài >= TILING_MIN_SIDE; số tile giới hạn theo ngân sách độ trễ (ms)
+app.config['TILING_ENABLED'] = os.environ.get('TILING_ENABLED', '0') == '1'
+app.config['TILING_MIN_SIDE'] = int(os.environ.get('TILING_MIN_SIDE', 1000))
+app.config['TILING_OVERLAP'] = float(os.environ.get('TILING_OVERLAP', 0.25))
+app.config['TILING_LATENCY_BUDGET_MS'] = float(os.environ.get('TILING_LATENCY_BUDGET_MS', 2000))
+app.config['TILING_MAX_TILES'] = int(os.environ.get('TILING_MAX_TILES', 64))
+
+# Admission control cho /predict và /compare_models (theo từng worker, 0 = tắt):
+# số request inference đồng thời, số request chờ mỗi lane, thời gian chờ tối đa (giây)
+app.config['ADMISSION_MAX_INFLIGHT'] = int(os.environ.get('ADMISSION_MAX_INFLIGHT', 2))
+app.config['ADMISSION_QUEUE_SIZE'] = int(os.environ.get('ADMISSION_QUEUE_SIZE', 4))
+app.config['ADMISSION_QUEUE_TIMEOUT'] = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 10))
+app.config['ADMISSION_RETRY_AFTER'] = int(os.environ.get('ADMISSION_RETRY_AFTER', 5))
+# Lane ưu tiên: header ADMISSION_PRIORITY_HEADER phải mang đúng ADMISSION_PRIORITY_TOKEN
+# (vd: reverse proxy gắn cho API clients); chưa đặt token thì mọi request vào lane 'normal'
+app.config['ADMISSION_PRIORITY_HEADER'] = os.environ.get('ADMISSION_PRIORITY_HEADER', 'X-Priority')
+app.config['ADMISSION_PRIORITY_TOKEN'] = os.environ.get('ADMISSION_PRIORITY_TOKEN', '')
+# Thread pools của entry point ASGI (asgi_app.py): inference mặc định đủ cho các request
+# đang chạy + đang chờ của admission control, route nhẹ (trang, static, /history) dùng pool riêng
+app.config['ASGI_INFERENCE_THREADS'] = int(os.environ.get(
+    'ASGI_INFERENCE_THREADS',
+    max(1, app.config['ADMISSION_MAX_INFLIGHT'] + 2 * app.config['ADMISSION_QUEUE_SIZE'])))
+app.config['ASGI_IO_THREADS'] = int(os.environ.get('ASGI_IO_THREADS', 8))
+
+# Ảnh gần trùng (pHash, khoảng cách Hamming <= NEAR_DUPLICATE_DISTANCE / 64 bit, 0 = tắt) với kết quả đã lưu:
+# 'flag' = vẫn chạy ensemble và đánh dấu kết quả trước, 'reuse' = dùng lại kết quả trước
+app.config['NEAR_DUPLICATE_DISTANCE'] = int(os.environ.get('NEAR_DUPLICATE_DISTANCE', 6))
+app.config['NEAR_DUPLICATE_MODE'] = os.environ.get('NEAR_DUPLICATE_MODE', 'flag')
+
+# Token cho các endpoint admin (header X-Admin-Token, '' = tắt endpoint admin)
+app.config['ADMIN_TOKEN'] = os.environ.get('ADMIN_TOKEN', '')
+# Thư mục lưu kết quả profiling theo yêu cầu (/admin/profile)
+app.config['PROFILE_DIR'] = os.environ.get(
+    'PROFILE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles'))
+
+# Kiểm tra tài nguyên của worker sau mỗi RESOURCE_CHECK_EVERY request inference (0 = tắt):
+# RSS tăng quá RSS_MAX_GROWTH_MB so với mốc sau RESOURCE_WARMUP_REQUESTS request -> xóa cache của models,
+# vẫn cao -> recycle worker (RECYCLE_ON_GROWTH=1, gunicorn tự tạo worker mới)
+app.config['RESOURCE_CHECK_EVERY'] = int(os.environ.get('RESOURCE_CHECK_EVERY', 50))
+app.config['RSS_MAX_GROWTH_MB'] = float(os.environ.get('RSS_MAX_GROWTH_MB', 512))
+app.config['RESOURCE_WARMUP_REQUESTS'] = int(os.environ.get('RESOURCE_WARMUP_REQUESTS', 20))
+app.config['RECYCLE_ON_GROWTH'] = os.environ.get('RECYCLE_ON_GROWTH', '0') == '1'
+# Dọn static/uploads: xóa file cũ hơn UPLOAD_MAX_AGE giây, giữ tối đa UPLOAD_MAX_FILES file (0 = không giới hạn)
+app.config['UPLOAD_MAX_AGE'] = float(os.environ.get('UPLOAD_MAX_AGE', 24 * 3600))
+app.config['UPLOAD_MAX_FILES'] = int(os.environ.get('UPLOAD_MAX_FILES', 1000))
 
 # Định nghĩa các lớp bệnh
 CLASS_NAMES = ['Caries', 'Fractured', 'Normal']
@@ -36,10 +131,41 @@ CLASS_NAMES_VN = {
 # Đường dẫn models
 MODEL_DIR = 'models'
 MODEL_VERSIONS = ['v1', 'v2', 'v3', 'v4']
+ENSEMBLE_MODEL_NAME = 'cbam_ensemble'
+# Model "nhanh" được distill từ ensemble (distill.py)
+STUDENT_MODEL_NAME = 'cbam_student'
+STUDENT_MODEL_FILE = 'best_teeth_student.h5'
+RESNET50_MODEL_NAME = 'resnet50'
+
+# Chuẩn hóa input (nằm trong graph model) của từng ModelSet
+# ResNet50 giữ chuẩn hóa [-1, 1] như trước đây ('resnet50' = kiểu caffe nếu model được train lại như vậy)
+MODEL_PREPROCESS = {
+    ENSEMBLE_MODEL_NAME: 'mobilenet_v2',
+    STUDENT_MODEL_NAME: 'mobilenet_v2',
+    RESNET50_MODEL_NAME: 'mobilenet_v2'
+}
+
+# Registry quản lý các phiên bản models (hot-swap khi file trong models/ thay đổi)
+model_registry = ModelRegistry(
+    memory_budget=int(app.config['MODEL_MEMORY_BUDGET_MB'] * 1024 * 1024),
+    idle_timeout=app.config['MODEL_IDLE_TIMEOUT']
+)
+results_store = None
+near_duplicate_index = None
+request_profiler = RequestProfiler(app.config['PROFILE_DIR'])
+admission = AdmissionController(
+    max_inflight=app.config['ADMISSION_MAX_INFLIGHT'],
+    queue_size=app.config['ADMISSION_QUEUE_SIZE'],
+    queue_timeout=app.config['ADMISSION_QUEUE_TIMEOUT']
+)
 
-# Biến global để lưu models
-loaded_models = []
-resnet50_model = None
+
+def upload_filename(original, prefix=''):
+    """
+    Tên file lưu trong UPLOAD_FOLDER: thêm tiền tố ngẫu nhiên để các request đồng thời
+    (worker gthread/ASGI) cùng tên file không ghi đè ảnh của nhau
+    """
+    return f"{prefix}{uuid.uuid4().hex[:12]}_{secure_filename(original)}"
 
 
 def allowed_file(filename):
@@ -48,33 +174,43 @@ def allowed_file(filename):
            filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
 
-def load_resnet50_model():
-    """Load ResNet50 model"""
-    global resnet50_model
-    
-    if resnet50_model:
-        return resnet50_model
-    
-    model_path = os.path.join(MODEL_DIR, 'best_resnet50.h5')
+def model_path_for(filename):
+    """Đường dẫn tuyệt đối đến file model trong MODEL_DIR"""
+    model_path = os.path.join(MODEL_DIR, filename)
     model_path = os.path.join(os.path.dirname(__file__), model_path)
-    model_path = os.path.normpath(model_path)
-    
-    if not os.path.exists(model_path):
-        raise FileNotFoundError(f"Không tìm thấy model ResNet50 tại: {model_path}")
+    return os.path.normpath(model_path)
+
+
+def load_h5_model(model_path, custom_objects=None):
+    """Load model .h5 (copy sang file tạm - workaround cho Unicode path)"""
+    with tempfile.NamedTemporaryFile(suffix='.h5', delete=False) as tmp_file:
+        temp_path = tmp_file.name
     
     try:
-        # Workaround cho Unicode path
-        import tempfile
-        import shutil
-        with tempfile.NamedTemporaryFile(suffix='.h5', delete=False) as tmp_file:
-            temp_path = tmp_file.name
-        
         shutil.copy2(model_path, temp_path)
         
-        # Load model - ResNet50 thường không cần custom objects
-        model = keras.models.load_model(temp_path, compile=False)
-        
+        if custom_objects:
+            with keras.utils.custom_object_scope(custom_objects):
+                return keras.models.load_model(temp_path, compile=False)
+        return keras.models.load_model(temp_path, compile=False)
+    finally:
         os.unlink(temp_path)
+
+
+def resnet50_paths():
+    return [('resnet50', model_path_for('best_resnet50.h5'))]
+
+
+def load_resnet50_files(paths):
+    """Load ResNet50 model (hàm load cho model_registry)"""
+    if not paths:
+        model_path = resnet50_paths()[0][1]
+        raise FileNotFoundError(f"Không tìm thấy model ResNet50 tại: {model_path}")
+    
+    label, model_path = paths[0]
+    try:
+        # Load model - ResNet50 thường không cần custom objects
+        model = load_h5_model(model_path)
         
         # Compile lại
         model.compile(
@@ -83,51 +219,41 @@ def load_resnet50_model():
             metrics=['accuracy']
         )
         
-        resnet50_model = model
         print("✓ Loaded ResNet50 model")
-        return model
+        return [model], [label]
     
     except Exception as e:
         raise RuntimeError(f"Lỗi khi load ResNet50 model: {str(e)}")
 
 
-def load_ensemble_models():
-    """Load tất cả models cho ensemble"""
-    global loaded_models
-    
-    if loaded_models:
-        return loaded_models
-    
-    custom_objects = {
-        'SparseCategoricalFocalLoss': SparseCategoricalFocalLoss,
-        'Mean': KerasMean,
-        'Max': KerasMax,
-        'channel_attention_module': channel_attention_module,
-        'spatial_attention_module': spatial_attention_module,
-        'cbam_block': cbam_block
-    }
+def ensemble_paths():
+    return [(version, model_path_for(f'best_teeth_cbam_focal_{version}.h5'))
+            for version in MODEL_VERSIONS]
+
+
+# Custom objects cho các model CBAM (ensemble và student)
+CBAM_CUSTOM_OBJECTS = {
+    'SparseCategoricalFocalLoss': SparseCategoricalFocalLoss,
+    'Mean': KerasMean,
+    'Max': KerasMax,
+    'channel_attention_module': channel_attention_module,
+    'spatial_attention_module': spatial_attention_module,
+    'cbam_block': cbam_block
+}
+
+
+def load_ensemble_files(paths):
+    """Load tất cả models cho ensemble (hàm load cho model_registry)"""
+    custom_objects = CBAM_CUSTOM_OBJECTS
     
+    found = dict(paths)
     models = []
-    for version in MODEL_VERSIONS:
-        model_path = os.path.join(MODEL_DIR, f'best_teeth_cbam_focal_{version}.h5')
-        model_path = os.path.join(os.path.dirname(__file__), model_path)
-        model_path = os.path.normpath(model_path)
-        
-        if os.path.exists(model_path):
+    versions = []
+    for version, model_path in ensemble_paths():
+        if version in found:
             try:
-                # Workaround cho Unicode path
-                import tempfile
-                import shutil
-                with tempfile.NamedTemporaryFile(suffix='.h5', delete=False) as tmp_file:
-                    temp_path = tmp_file.name
-                
-                shutil.copy2(model_path, temp_path)
-                
                 # Load model với Keras 3
-                with keras.utils.custom_object_scope(custom_objects):
-                    model = keras.models.load_model(temp_path, compile=False)
-                
-                os.unlink(temp_path)
+                model = load_h5_model(model_path, custom_objects)
                 
                 # Compile lại
                 model.compile(
@@ -136,6 +262,7 @@ def load_ensemble_models():
                     metrics=['accuracy']
                 )
                 models.append(model)
+                versions.append(version)
                 print(f"✓ Loaded model: {version}")
             except Exception as e:
                 print(f"✗ Error loading {version}: {str(e)}")
@@ -145,34 +272,174 @@ def load_ensemble_models():
     if not models:
         raise RuntimeError("Không tìm thấy model nào! Vui lòng đặt file .h5 vào thư mục models/")
     
-    loaded_models = models
     print(f"\n✅ Đã load {len(models)} models cho ensemble")
-    return models
+    return models, versions
+
+
+def student_paths():
+    return [('student', model_path_for(STUDENT_MODEL_FILE))]
+
+
+def load_student_files(paths):
+    """Load model student đã distill (hàm load cho model_registry)"""
+    if not paths:
+        raise FileNotFoundError(
+            f"Không tìm thấy model nhanh tại: {student_paths()[0][1]} (chạy distill.py để tạo)")
+    
+    label, model_path = paths[0]
+    model = load_h5_model(model_path, CBAM_CUSTOM_OBJECTS)
+    print("✓ Loaded student model")
+    return [model], [label]
 
 
-def predict_with_resnet50(img_path):
+def resolve_precision(precision=None):
     """
-    Dự đoán ảnh sử dụng ResNet50 model
+    Độ chính xác thực tế dùng cho inference
+    (None = theo cấu hình; 'bfloat16' về 'float32' nếu CPU không hỗ trợ)
     """
-    model = load_resnet50_model()
-    
-    # Load và preprocess ảnh
-    img = image.load_img(img_path, target_size=(224, 224))
-    img_array = image.img_to_array(img)
-    img_array = np.expand_dims(img_array, axis=0)
-    img_array = preprocess_input(img_array)
+    if precision is None:
+        precision = app.config['INFERENCE_PRECISION']
+    if precision not in PRECISIONS:
+        raise ValueError(f"Precision không hợp lệ: {precision} (chọn {', '.join(PRECISIONS)})")
+    if precision == 'bfloat16' and not BF16_SUPPORTED:
+        return 'float32'
+    return precision
+
+
+def get_inference_models(model_set, precision='float32'):
+    """Các model của ModelSet theo độ chính xác (bản bfloat16 được tạo một lần và cache)"""
+    if precision == 'float32':
+        return model_set.models
+    return model_set.cached(
+        f'models:{precision}',
+        lambda model_set: tuple(to_bfloat16(model) for model in model_set.models))
+
+
+def get_serving_models(model_set, precision='float32'):
+    """Các model nhận ảnh uint8 (resize + preprocess_input trong graph), cache theo phiên bản"""
+    mode = MODEL_PREPROCESS[model_set.name]
+    return model_set.cached(
+        f'serving:{precision}',
+        lambda model_set: tuple(with_uint8_input(model, mode)
+                                for model in get_inference_models(model_set, precision)))
+
+
+def build_predict_fns(model_set, precision='float32'):
+    """
+    Hàm dự đoán cho từng model trong ModelSet (input: batch ảnh uint8):
+    forward pass biên dịch XLA (theo bucket batch size) nếu bật XLA_ENABLED, ngược lại predict_on_batch
+    (predict_on_batch không tạo data adapter/iterator mới mỗi lần gọi như model.predict)
+    """
+    models = get_serving_models(model_set, precision)
+    if app.config['XLA_ENABLED']:
+        return [
+            CompiledPredictor(model, app.config['XLA_BATCH_BUCKETS'], input_dtype=np.uint8,
+                              name=f'{model_set.name}:{version}:{precision}').warmup()
+            for model, version in zip(models, model_set.versions)
+        ]
+    return [
+        lambda x, model=model: model.predict_on_batch(x)
+        for model in models
+    ]
+
+
+def get_predict_fns(model_set, precision=None):
+    """Hàm dự đoán đã build (cache theo phiên bản ModelSet và độ chính xác)"""
+    precision = resolve_precision(precision)
+    return model_set.cached(f'predict_fns:{precision}',
+                            lambda model_set: build_predict_fns(model_set, precision))
+
+
+def warmup_models(model_set):
+    """Chạy thử một ảnh rỗng qua từng model để build predict function trước khi dùng"""
+    dummy = np.zeros((1, 224, 224, 3), dtype=np.uint8)
+    for predict_fn in get_predict_fns(model_set):
+        predict_fn(dummy)
     
-    # Prediction
-    probs = model.predict(img_array, verbose=0)
+    if app.config['XLA_ENABLED'] and app.config['TTA_ENABLED'] and model_set.name != RESNET50_MODEL_NAME:
+        get_fused_predict_fn(model_set)
+
+
+def estimate_model_bytes(models):
+    """Ước lượng bộ nhớ weights của các model (bytes)"""
+    return sum(
+        int(np.prod(weight.shape)) * np.dtype(weight.dtype).itemsize
+        for model in models
+        for weight in model.weights
+    )
+
+
+# Ensemble dùng cho mọi request -> pinned; ResNet50 chỉ dùng ở /compare_models -> có thể bị giải phóng
+model_registry.register(ENSEMBLE_MODEL_NAME, ensemble_paths, load_ensemble_files, warmup_models,
+                        size_fn=estimate_model_bytes, pinned=True)
+model_registry.register(RESNET50_MODEL_NAME, resnet50_paths, load_resnet50_files, warmup_models,
+                        size_fn=estimate_model_bytes)
+model_registry.register(STUDENT_MODEL_NAME, student_paths, load_student_files, warmup_models,
+                        size_fn=estimate_model_bytes)
+
+if app.config['MODEL_WATCH_INTERVAL'] > 0:
+    model_registry.start_watcher(app.config['MODEL_WATCH_INTERVAL'])
+elif app.config['MODEL_IDLE_TIMEOUT'] > 0:
+    model_registry.start_watcher(min(60, app.config['MODEL_IDLE_TIMEOUT']), watch_files=False)
+
+
+def get_ensemble():
+    """Phiên bản CBAM ensemble đang active (ModelSet)"""
+    return model_registry.get(ENSEMBLE_MODEL_NAME)
+
+
+def student_available():
+    """Có model nhanh (student) trong thư mục models không"""
+    return os.path.exists(student_paths()[0][1])
+
+
+def get_prediction_models(fast=False):
+    """ModelSet dùng để dự đoán: student ("nhanh", 1 model) hoặc CBAM ensemble"""
+    if fast:
+        return model_registry.get(STUDENT_MODEL_NAME)
+    return get_ensemble()
+
+
+def load_resnet50_model():
+    """Load ResNet50 model"""
+    return model_registry.get(RESNET50_MODEL_NAME).models[0]
+
+
+def load_ensemble_models():
+    """Load tất cả models cho ensemble"""
+    return list(get_ensemble().models)
+
+
+def load_image_array(img_path):
+    """Load ảnh thành mảng uint8 (224, 224, 3), giống model input của CV stage"""
+    return load_model_input(img_path)
+
+
+def preprocess_image(img_path, img_array=None):
+    """
+    Load ảnh thành batch uint8 (1, 224, 224, 3) cho model
+    (resize và preprocess_input nằm trong graph của model, xem graph_preprocess.py)
     
-    # Lấy kết quả
-    predicted_class_idx = np.argmax(probs[0])
+    Args:
+        img_path: Đường dẫn ảnh
+        img_array: Ảnh RGB uint8 đã decode sẵn (vd: từ CV stage), bỏ qua img_path nếu có
+    """
+    if img_array is None:
+        img_array = load_image_array(img_path)
+    return np.asarray(img_array, dtype=np.uint8)[np.newaxis]
+
+
+def format_prediction(probs):
+    """
+    Chuyển vector xác suất (len(CLASS_NAMES),) thành dict kết quả
+    """
+    predicted_class_idx = np.argmax(probs)
     predicted_class = CLASS_NAMES[predicted_class_idx]
-    confidence = probs[0][predicted_class_idx] * 100
+    confidence = probs[predicted_class_idx] * 100
     
     # Tạo dict xác suất cho tất cả các class
     probabilities = {
-        CLASS_NAMES_VN[cls]: float(probs[0][idx] * 100)
+        CLASS_NAMES_VN[cls]: float(probs[idx] * 100)
         for idx, cls in enumerate(CLASS_NAMES)
     }
     
@@ -184,53 +451,704 @@ def predict_with_resnet50(img_path):
     }
 
 
-def predict_image(img_path):
+def predict_with_resnet50(img_path, precision=None):
     """
-    Dự đoán ảnh sử dụng ensemble model
+    Dự đoán ảnh sử dụng ResNet50 model
+    
+    Args:
+        precision: 'float32' hoặc 'bfloat16' (None = theo app.config['INFERENCE_PRECISION'])
     """
-    models = load_ensemble_models()
+    model_set = model_registry.get(RESNET50_MODEL_NAME)
+    precision = resolve_precision(precision)
+    
+    img_array = preprocess_image(img_path)
+    probs = get_predict_fns(model_set, precision)[0](img_array)
     
-    # Load và preprocess ảnh
-    img = image.load_img(img_path, target_size=(224, 224))
-    img_array = image.img_to_array(img)
-    img_array = np.expand_dims(img_array, axis=0)
-    img_array = preprocess_input(img_array)
+    result = format_prediction(np.asarray(probs[0], dtype=np.float32))
+    result['model_versions'] = list(model_set.versions)
+    result['precision'] = precision
+    return result
+
+
+def iter_ensemble_predictions(img_path, img_array=None, model_set=None, precision=None):
+    """
+    Chạy lần lượt từng model trong ensemble, sau mỗi model yield kết quả tạm thời
+    
+    Args:
+        model_set: Phiên bản ensemble dùng cho cả request (mặc định: phiên bản active)
+        precision: 'float32' hoặc 'bfloat16' (None = theo cấu hình); trung bình luôn tính bằng float
+    
+    Yields:
+        tuple: (version, completed, total, partial_result)
+            - partial_result là trung bình xác suất của các model đã chạy xong
+    """
+    if model_set is None:
+        model_set = get_ensemble()
+    precision = resolve_precision(precision)
+    predict_fns = get_predict_fns(model_set, precision)
+    img_array = preprocess_image(img_path, img_array)
     
-    # Ensemble prediction
     ensemble_probs = np.zeros((1, len(CLASS_NAMES)))
     
-    for model in models:
-        probs = model.predict(img_array, verbose=0)
-        ensemble_probs += probs
+    for completed, (version, predict_fn) in enumerate(zip(model_set.versions, predict_fns), start=1):
+        probs = predict_fn(img_array)
+        ensemble_probs += np.asarray(probs, dtype=np.float32)
+        result = format_prediction(ensemble_probs[0] / completed)
+        result['model_name'] = model_set.name
+        result['model_versions'] = list(model_set.versions[:completed])
+        result['precision'] = precision
+        yield version, completed, len(predict_fns), result
+
+
+def build_fused_ensemble(model_set, precision='float32'):
+    """
+    Gộp các model trong ensemble thành một keras.Model duy nhất (trung bình softmax)
+    để chạy cả batch qua toàn bộ ensemble trong một lần forward
     
-    ensemble_probs /= len(models)
+    Input là batch ảnh uint8, preprocess một lần trong graph rồi dùng chung cho các model
+    """
+    inputs = uint8_input()
+    x = ImagePreprocess(MODEL_PREPROCESS[model_set.name])(inputs)
+    outputs = [model(x) for model in get_inference_models(model_set, precision)]
+    if len(outputs) > 1:
+        # Trung bình softmax luôn tính bằng float32
+        output = keras.layers.Average(dtype='float32')(outputs)
+    else:
+        output = outputs[0]
     
-    # Lấy kết quả
-    predicted_class_idx = np.argmax(ensemble_probs[0])
-    predicted_class = CLASS_NAMES[predicted_class_idx]
-    confidence = ensemble_probs[0][predicted_class_idx] * 100
+    return keras.Model(inputs, output, name=ENSEMBLE_MODEL_NAME)
+
+
+def get_fused_ensemble(model_set=None, precision=None):
+    """Model ensemble đã gộp, gắn với phiên bản ensemble (tạo một lần cho mỗi phiên bản)"""
+    if model_set is None:
+        model_set = get_ensemble()
+    precision = resolve_precision(precision)
+    return model_set.cached(f'fused:{precision}',
+                            lambda model_set: build_fused_ensemble(model_set, precision))
+
+
+def get_fused_predict_fn(model_set=None, precision=None):
+    """Hàm dự đoán cho ensemble đã gộp (biên dịch XLA nếu bật)"""
+    if model_set is None:
+        model_set = get_ensemble()
+    precision = resolve_precision(precision)
     
-    # Tạo dict xác suất cho tất cả các class
-    probabilities = {
-        CLASS_NAMES_VN[cls]: float(ensemble_probs[0][idx] * 100)
-        for idx, cls in enumerate(CLASS_NAMES)
+    def build(model_set):
+        fused = get_fused_ensemble(model_set, precision)
+        if app.config['XLA_ENABLED']:
+            buckets = set(app.config['XLA_BATCH_BUCKETS']) | {app.config['TTA_NUM_VIEWS']}
+            return CompiledPredictor(fused, buckets, input_dtype=np.uint8,
+                                     name=f'{model_set.name}:fused:{precision}').warmup()
+        return lambda x: fused.predict_on_batch(x)
+    
+    return model_set.cached(f'fused_predict_fn:{precision}', build)
+
+
+def predict_image_tta(img_path, num_views=None, img_array=None, model_set=None, precision=None):
+    """
+    Dự đoán với test-time augmentation: tất cả biến thể được gộp thành một batch
+    và chạy qua ensemble đã gộp trong một lần forward
+    """
+    if num_views is None:
+        num_views = app.config['TTA_NUM_VIEWS']
+    
+    if img_array is None:
+        img_array = load_image_array(img_path)
+    
+    batch = build_tta_batch(img_array, num_views)
+    
+    if model_set is None:
+        model_set = get_ensemble()
+    precision = resolve_precision(precision)
+    probs = get_fused_predict_fn(model_set, precision)(batch)
+    
+    result = format_prediction(aggregate_tta_probs(probs))
+    result['tta_views'] = len(batch)
+    result['model_name'] = model_set.name
+    result['model_versions'] = list(model_set.versions)
+    result['precision'] = precision
+    return result
+
+
+def should_use_tiling(img_path, tiled=None):
+    """Kiểm tra có chia tile không (opt-in + ảnh đủ lớn)"""
+    if tiled is None:
+        tiled = app.config['TILING_ENABLED']
+    return bool(tiled) and max(tiling.image_size(img_path)) >= app.config['TILING_MIN_SIDE']
+
+
+def get_tile_cost(model_set, precision):
+    """
+    Ước lượng thời gian (ms) cho mỗi tile qua ensemble đã gộp, gắn với phiên bản ensemble
+    - Đo lần đầu bằng một batch giả (đồng thời warm up), sau đó cập nhật theo các request thực tế
+    """
+    def measure(model_set):
+        predict_fn = get_fused_predict_fn(model_set, precision)
+        batch = np.zeros((4, tiling.TILE_SIZE, tiling.TILE_SIZE, 3), dtype=np.uint8)
+        predict_fn(batch)
+        start = time.perf_counter()
+        predict_fn(batch)
+        return {'ms_per_tile': (time.perf_counter() - start) * 1000 / len(batch)}
+    
+    return model_set.cached(f'tile_cost:{precision}', measure)
+
+
+def tile_limit(cost):
+    """Số tile tối đa vừa ngân sách độ trễ"""
+    max_tiles = int(app.config['TILING_LATENCY_BUDGET_MS'] / max(cost['ms_per_tile'], 1e-3))
+    return max(1, min(max_tiles, app.config['TILING_MAX_TILES']))
+
+
+def predict_image_tiled(img_path, img_array=None, model_set=None, precision=None):
+    """
+    Dự đoán ảnh toàn cảnh độ phân giải cao theo tile: các tile chồng lấn và ảnh thu nhỏ
+    toàn cục được gộp thành một batch và chạy qua ensemble đã gộp trong một lần forward.
+    Kết luận cả ảnh (class, confidence) lấy từ view toàn cục; các tile chỉ dùng cho bản đồ theo vùng
+    
+    Args:
+        img_array: Ảnh RGB (224, 224, 3) đã decode sẵn (view toàn cục, tùy chọn)
+    
+    Returns:
+        dict: Giống predict_image, thêm 'tiles' (số tile, lưới và bản đồ xác suất theo vùng)
+    """
+    if model_set is None:
+        model_set = get_ensemble()
+    precision = resolve_precision(precision)
+    predict_fn = get_fused_predict_fn(model_set, precision)
+    cost = get_tile_cost(model_set, precision)
+    
+    full_image = tiling.load_rgb(img_path)
+    height, width = full_image.shape[:2]
+    scale, boxes, stride = tiling.plan_tiles(height, width, tile_limit(cost) - 1,
+                                             overlap=app.config['TILING_OVERLAP'])
+    if img_array is None:
+        img_array = load_image_array(img_path)
+    
+    batch = np.concatenate([tiling.extract_tiles(full_image, scale, boxes),
+                            preprocess_image(img_path, img_array)])
+    
+    start = time.perf_counter()
+    probs = np.asarray(predict_fn(batch), dtype=np.float32)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    # Cập nhật ước lượng (trung bình trượt) để các request sau bám sát ngân sách
+    cost['ms_per_tile'] = 0.8 * cost['ms_per_tile'] + 0.2 * elapsed_ms / len(batch)
+    
+    metrics.inc('tiling.requests')
+    metrics.inc('tiling.tiles', len(batch))
+    metrics.set_gauge('tiling.ms_per_tile', cost['ms_per_tile'])
+    if scale < 1:
+        metrics.inc('tiling.downscaled')
+    
+    # View toàn cục (phần tử cuối batch) quyết định kết luận; max/min qua nhiều tile sẽ lệch về bệnh lý
+    result = format_prediction(probs[-1])
+    region_map = tiling.probability_map(probs[:-1], boxes, stride) * 100
+    result['tiles'] = {
+        'count': len(boxes),
+        'scale': scale,
+        'cell_size': int(round(stride / scale)),
+        'grid': list(region_map.shape[:2]),
+        'classes': [CLASS_NAMES_VN[cls] for cls in CLASS_NAMES],
+        'map': np.round(region_map, 1).tolist(),
+        'latency_ms': elapsed_ms
     }
+    # Lưu lịch sử tách biệt với kết quả không chia tile (không dùng lại làm cache)
+    result['model_name'] = f'{model_set.name}:tiled'
+    result['model_versions'] = list(model_set.versions)
+    result['precision'] = precision
+    return result
+
+
+def should_use_tta(result, tta=None):
+    """Kiểm tra có cần chạy TTA không (opt-in + độ tin cậy thấp hơn ngưỡng)"""
+    if tta is None:
+        tta = app.config['TTA_ENABLED']
+    return bool(tta) and result['confidence'] < app.config['TTA_CONFIDENCE_THRESHOLD']
+
+
+def predict_image(img_path, tta=None, img_array=None, fast=False, precision=None, tiled=None):
+    """
+    Dự đoán ảnh sử dụng ensemble model
+    
+    Args:
+        img_path: Đường dẫn ảnh
+        tta: Bật/tắt test-time augmentation (None = theo app.config['TTA_ENABLED'])
+        img_array: Ảnh RGB (224, 224, 3) đã decode sẵn (tùy chọn)
+        fast: Dùng model student đã distill thay cho ensemble 4 models
+        precision: 'float32' hoặc 'bfloat16' (None = theo app.config['INFERENCE_PRECISION'])
+        tiled: Chia tile ảnh lớn (None = theo app.config['TILING_ENABLED'])
+    """
+    # Giữ một phiên bản ensemble cho cả request (an toàn khi hot-swap)
+    model_set = get_prediction_models(fast)
+    
+    if should_use_tiling(img_path, tiled):
+        return predict_image_tiled(img_path, img_array, model_set, precision)
+    
+    result = None
+    for _, _, _, result in iter_ensemble_predictions(img_path, img_array, model_set, precision):
+        pass
+    
+    if should_use_tta(result, tta):
+        base_confidence = result['confidence']
+        result = predict_image_tta(img_path, img_array=img_array, model_set=model_set,
+                                   precision=precision)
+        result['base_confidence'] = base_confidence
+    
+    return result
+
+
+def add_severity_analysis(filepath, result, image_features=None):
+    """
+    Phân tích đặc trưng ảnh, đánh giá mức độ nghiêm trọng và thêm lời khuyên y khoa vào result
+    
+    Args:
+        image_features: Kết quả analyze_image_features đã tính sẵn (vd: từ CV stage)
+    """
+    if image_features is None:
+        image_features = analyze_image_features(filepath)
+    severity_level = classify_severity_level(
+        image_features['severity_score'],
+        result['class']
+    )
+    
+    result['severity_level'] = severity_level
+    result['severity_score'] = image_features['severity_score']
+    result['image_features'] = image_features
+    result['medical_advice'] = get_medical_advice(result['class'], severity_level)
+    return result
+
+
+def render_result(filename, result):
+    """Render trang kết quả từ result đã có đầy đủ thông tin severity"""
+    return render_template('result.html',
+                           filename=filename,
+                           tiles=result.get('tiles'),
+                           near_duplicate=result.get('near_duplicate'),
+                           prediction=result['class_vn'],
+                           confidence=f"{result['confidence']:.2f}",
+                           probabilities=result['probabilities'],
+                           severity_level=result['severity_level'],
+                           severity_score=f"{result['severity_score']:.1f}",
+                           medical_advice=result['medical_advice'],
+                           image_features=result['image_features'])
+
+
+def run_cv_stage(filepath, with_features=True):
+    """Chạy CV stage của một ảnh trong process pool và chờ kết quả"""
+    if g.get('profiling'):
+        # Request đang được profile: chạy trực tiếp để cProfile thấy image_analyzer
+        return run_cv_stage_inline(filepath, with_features)
+    return submit_cv_stage(filepath, with_features,
+                           max_workers=app.config['CV_POOL_WORKERS']).result()
+
+
+def start_feature_stage(filepath):
+    """
+    Bắt đầu analyze_image_features (ảnh gốc) trong process pool để chạy song song với inference
+    
+    Returns:
+        callable: Gọi để lấy image_features (chờ process con nếu chưa xong)
+    """
+    if g.get('profiling'):
+        image_features = run_feature_stage(filepath)
+        return lambda: image_features
+    return submit_feature_stage(filepath, max_workers=app.config['CV_POOL_WORKERS']).result
+
+
+def get_results_store():
+    """Lấy kho kết quả SQLite (None nếu tắt)"""
+    global results_store
+    
+    if results_store is None and app.config['RESULTS_DB']:
+        results_store = ResultsStore(app.config['RESULTS_DB'])
+    return results_store
+
+
+def get_near_duplicate_index():
+    """Chỉ mục pHash của kho kết quả (None nếu tắt)"""
+    global near_duplicate_index
+    
+    store = get_results_store()
+    if near_duplicate_index is None and store is not None and app.config['NEAR_DUPLICATE_DISTANCE'] > 0:
+        near_duplicate_index = NearDuplicateIndex(store)
+    return near_duplicate_index
+
+
+def find_cached_result(image_hash, model_set):
+    """
+    Tìm kết quả đã lưu của ảnh (cùng nội dung, cùng model và phiên bản)
+    
+    Returns:
+        dict giống predict_image + add_severity_analysis, hoặc None
+    """
+    store = get_results_store()
+    if store is None:
+        return None
+    
+    record = store.find_latest(image_hash, model_set.name, model_set.versions)
+    if record is None:
+        return None
+    return record_to_result(record)
+
+
+def find_near_duplicate(perceptual_hash, model_set):
+    """
+    Tìm kết quả đã lưu của ảnh gần trùng (pHash trong NEAR_DUPLICATE_DISTANCE, cùng model và phiên bản)
+    
+    Returns:
+        dict: {'record': bản ghi gần nhất (mới nhất nếu cùng khoảng cách), 'distance': int}, hoặc None
+    """
+    index = get_near_duplicate_index()
+    if index is None or perceptual_hash is None:
+        return None
+    
+    matches = index.search(perceptual_hash, app.config['NEAR_DUPLICATE_DISTANCE'])
+    if not matches:
+        return None
+    
+    distances = {record_id: distance for distance, record_id in matches}
+    records = [
+        record for record in get_results_store().get_results(list(distances))
+        if record['model_name'] == model_set.name and record['model_versions'] == list(model_set.versions)
+    ]
+    if not records:
+        return None
+    
+    # get_results trả mới nhất trước -> min giữ bản ghi mới nhất khi cùng khoảng cách
+    record = min(records, key=lambda record: distances[record['id']])
+    metrics.inc('near_duplicate.matches')
+    return {'record': record, 'distance': distances[record['id']]}
+
+
+def near_duplicate_info(match, reused):
+    """
+    Thông tin ảnh gần trùng gắn vào result (hiển thị cho người upload)
+    Không chứa filename/id/thời điểm của bản ghi kia: đó là dữ liệu của bệnh nhân khác
+    """
+    predicted_class = match['record']['predicted_class']
+    return {
+        'distance': match['distance'],
+        'reused': reused,
+        'class': predicted_class,
+        'class_vn': CLASS_NAMES_VN[predicted_class]
+    }
+
+
+def reuse_near_duplicate(perceptual_hash, model_set):
+    """
+    Kiểm tra ảnh gần trùng trước khi chạy ensemble
     
+    Returns:
+        tuple: (result dùng lại hoặc None, thông tin ảnh gần trùng hoặc None)
+    """
+    match = find_near_duplicate(perceptual_hash, model_set)
+    if match is None:
+        return None, None
+    
+    if app.config['NEAR_DUPLICATE_MODE'] == 'reuse':
+        metrics.inc('near_duplicate.reused')
+        result = record_to_result(match['record'])
+        result['near_duplicate'] = near_duplicate_info(match, reused=True)
+        return result, result['near_duplicate']
+    return None, near_duplicate_info(match, reused=False)
+
+
+def record_to_result(record):
+    """Chuyển bản ghi trong kho thành dict giống predict_image + add_severity_analysis"""
+    predicted_class = record['predicted_class']
     return {
         'class': predicted_class,
         'class_vn': CLASS_NAMES_VN[predicted_class],
-        'confidence': float(confidence),
-        'probabilities': probabilities
+        'confidence': record['confidence'],
+        'probabilities': record['probabilities'],
+        'severity_level': record['severity_level'],
+        'severity_score': record['severity_score'],
+        'image_features': record['image_features'],
+        'medical_advice': get_medical_advice(predicted_class, record['severity_level']),
+        'tta_views': record['tta_views'],
+        'model_name': record['model_name'],
+        'model_versions': record['model_versions'],
+        'cached_at': record['created_at']
+    }
+
+
+def save_result(image_hash, result, filename):
+    """Lưu kết quả vào kho (bỏ qua nếu tắt)"""
+    store = get_results_store()
+    if store is not None:
+        store.save_result(image_hash, result, result['model_name'], result['model_versions'], filename)
+
+
+def result_payload(result):
+    """Các trường của result có thể serialize thành JSON"""
+    return {
+        'class': result['class'],
+        'class_vn': result['class_vn'],
+        'confidence': result['confidence'],
+        'probabilities': result['probabilities'],
+        'severity_level': result['severity_level'],
+        'severity_score': result['severity_score'],
+        'image_features': result['image_features'],
+        'medical_advice': result['medical_advice'],
+        'tta_views': result.get('tta_views', 0),
+        'tiles': result.get('tiles'),
+        'near_duplicate': result.get('near_duplicate'),
+        'model_name': result['model_name'],
+        'model_versions': result['model_versions'],
+        'cached': 'cached_at' in result
     }
 
 
+def sse_event(event, data):
+    """Định dạng một server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def stream_prediction(filepath, filename, tta=None, fast=False, tiled=None):
+    """
+    Generator cho chế độ streaming của /predict (text/event-stream)
+    
+    Thứ tự event:
+        validity -> model (mỗi model trong ensemble) -> result -> done
+        (ảnh đã phân tích trước đó hoặc dùng lại kết quả ảnh gần trùng: validity -> result -> done)
+        (ảnh chia tile: validity -> tiles -> result -> done)
+    """
+    try:
+        model_set = get_prediction_models(fast)
+        image_hash = compute_image_hash(filepath)
+        tiled = should_use_tiling(filepath, tiled)
+        cached = None if tiled else find_cached_result(image_hash, model_set)
+        if cached is not None:
+            yield sse_event('validity', {'is_valid': True, 'confidence': None, 'reason': ''})
+            yield sse_event('result', result_payload(cached))
+            yield sse_event('done', {'html': render_result(filename, cached)})
+            return
+        
+        # Chỉ kiểm tra hợp lệ trước để gửi event validity sớm, đặc trưng ảnh tính song song với inference
+        stage = run_cv_stage(filepath, with_features=False)
+        is_valid, confidence_score, reason = stage['is_valid'], stage['confidence'], stage['reason']
+        yield sse_event('validity', {
+            'is_valid': bool(is_valid),
+            'confidence': float(confidence_score),
+            'reason': reason
+        })
+        
+        if not is_valid:
+            html = render_template('invalid_image.html',
+                                   filename=filename,
+                                   reason=reason,
+                                   confidence=f"{confidence_score:.1f}")
+            yield sse_event('done', {'html': html})
+            return
+        
+        reused, near_duplicate = (None, None) if tiled else reuse_near_duplicate(
+            stage['perceptual_hash'], model_set)
+        if reused is not None:
+            yield sse_event('result', result_payload(reused))
+            yield sse_event('done', {'html': render_result(filename, reused)})
+            return
+        
+        image_features = start_feature_stage(filepath)
+        result = None
+        if tiled:
+            result = predict_image_tiled(filepath, stage['model_input'], model_set)
+            yield sse_event('tiles', {
+                'count': result['tiles']['count'],
+                'grid': result['tiles']['grid'],
+                'prediction': {key: result[key] for key in ('class', 'class_vn', 'confidence')}
+            })
+        else:
+            for version, completed, total, result in iter_ensemble_predictions(
+                    filepath, stage['model_input'], model_set):
+                yield sse_event('model', {
+                    'version': version,
+                    'completed': completed,
+                    'total': total,
+                    'prediction': result
+                })
+        
+        if not tiled and should_use_tta(result, tta):
+            base_confidence = result['confidence']
+            result = predict_image_tta(filepath, img_array=stage['model_input'],
+                                       model_set=model_set)
+            result['base_confidence'] = base_confidence
+            yield sse_event('tta', {
+                'views': result['tta_views'],
+                'base_confidence': base_confidence,
+                'prediction': result
+            })
+        
+        result['perceptual_hash'] = stage['perceptual_hash']
+        if near_duplicate is not None:
+            result['near_duplicate'] = near_duplicate
+        add_severity_analysis(filepath, result, image_features())
+        save_result(image_hash, result, filename)
+        yield sse_event('result', result_payload(result))
+        yield sse_event('done', {'html': render_result(filename, result)})
+    
+    except Exception as e:
+        yield sse_event('error', {'message': f'Lỗi khi xử lý ảnh: {str(e)}'})
+
+
+def request_lane():
+    """Lane ưu tiên của request hiện tại ('high' hoặc 'normal')"""
+    token = app.config['ADMISSION_PRIORITY_TOKEN']
+    priority = request.headers.get(app.config['ADMISSION_PRIORITY_HEADER'], '')
+    # Client không thể tự gắn lane ưu tiên nếu không biết token
+    return 'high' if token and hmac.compare_digest(priority.encode(), token.encode()) else 'normal'
+
+
+def overloaded_response(error):
+    """Response 503 khi worker quá tải (JSON cho API clients, text cho trình duyệt)"""
+    message = 'Máy chủ đang quá tải, vui lòng thử lại sau ít giây'
+    if request.accept_mimetypes.best == 'application/json':
+        response = jsonify({'error': message, 'lane': error.lane, 'reason': error.reason})
+    else:
+        response = make_response(message)
+        response.mimetype = 'text/plain'
+    response.status_code = 503
+    response.headers['Retry-After'] = str(app.config['ADMISSION_RETRY_AFTER'])
+    return response
+
+
+def admission_controlled(view):
+    """
+    Decorator giới hạn số request inference đồng thời (chỉ áp dụng cho POST)
+    - Nhận xong file upload rồi mới lấy slot: client upload chậm không giữ slot inference
+    - Request bị từ chối/đang chờ chưa decode ảnh
+    - Response streaming giữ slot đến khi stream kết thúc
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method != 'POST':
+            return view(*args, **kwargs)
+        
+        # Đọc hết body (form + file) trước khi lấy slot
+        request.files
+        try:
+            admission.acquire(request_lane())
+        except Overloaded as e:
+            return overloaded_response(e)
+        
+        try:
+            response = make_response(view(*args, **kwargs))
+        except Exception:
+            admission.release()
+            raise
+        
+        if response.is_streamed:
+            response.call_on_close(admission.release)
+        else:
+            admission.release()
+        return response
+    
+    return wrapper
+
+
+def profiled(view):
+    """
+    Decorator profile request khi profiling đang bật (/admin/profile)
+    Response streaming (giao diện web luôn dùng ?stream=1) được profile đến khi stream kết thúc
+    Khi tắt chỉ tốn một phép so sánh
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not request_profiler.active or not request_profiler.claim():
+            return view(*args, **kwargs)
+        
+        g.profiling = True
+        with ExitStack() as stack:
+            stack.enter_context(request_profiler.profile(
+                f"{request.method} {request.full_path.rstrip('?')}"))
+            response = make_response(view(*args, **kwargs))
+            if response.is_streamed:
+                # Server lấy body và gọi close() trên cùng thread -> dừng profile khi stream xong
+                response.call_on_close(stack.pop_all().close)
+        return response
+    
+    return wrapper
+
+
+def require_admin():
+    """Chỉ cho phép request có X-Admin-Token đúng (404 nếu chưa cấu hình ADMIN_TOKEN)"""
+    token = app.config['ADMIN_TOKEN']
+    if not token:
+        abort(404)
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), token):
+        abort(403)
+
+
+def model_tracing_count():
+    """Tổng số lần trace tf.function của các model/hàm dự đoán đang cache (tăng liên tục = retracing)"""
+    total = 0
+    for model_set in model_registry.loaded():
+        total += sum(tracing_count(model) for model in model_set.models)
+        for value in list(model_set.cache.values()):
+            for item in (value if isinstance(value, (list, tuple)) else [value]):
+                total += tracing_count(item)
+    return total
+
+
+def clean_uploads():
+    """Dọn thư mục uploads theo UPLOAD_MAX_AGE / UPLOAD_MAX_FILES"""
+    removed = prune_uploads(app.config['UPLOAD_FOLDER'], app.config['UPLOAD_MAX_AGE'],
+                            app.config['UPLOAD_MAX_FILES'])
+    if removed:
+        metrics.inc('uploads.pruned', removed)
+
+
+def recycle_worker():
+    """Yêu cầu worker tự thoát sau khi xong các request đang chạy (gunicorn tạo worker mới)"""
+    if app.config['RECYCLE_ON_GROWTH']:
+        os.kill(os.getpid(), signal.SIGTERM)
+
+
+resource_guard = ResourceGuard(
+    check_every=app.config['RESOURCE_CHECK_EVERY'],
+    max_rss_growth=int(app.config['RSS_MAX_GROWTH_MB'] * 1024 * 1024),
+    warmup_requests=app.config['RESOURCE_WARMUP_REQUESTS'],
+    clear_fn=lambda: model_registry.clear_caches(reason='rss_growth'),
+    recycle_fn=recycle_worker,
+    tracing_fn=model_tracing_count,
+    maintenance_fn=clean_uploads
+)
+
+
+@app.after_request
+def track_resources(response):
+    """Kiểm tra tài nguyên định kỳ sau các request inference"""
+    if request.endpoint in ('predict', 'compare_models') and request.method == 'POST':
+        resource_guard.request_done()
+    return response
+
+
+@app.after_request
+def add_model_version_header(response):
+    """Báo phiên bản models đang active trong mọi response"""
+    versions = model_registry.active_versions()
+    if versions:
+        response.headers['X-Model-Versions'] = '; '.join(
+            f'{name}={version}' for name, version in sorted(versions.items()))
+    return response
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Metrics của worker hiện tại (JSON)"""
+    data = metrics.snapshot()
+    data['model_versions'] = model_registry.active_versions()
+    return jsonify(data)
+
+
 @app.route('/')
 def index():
     """Trang chủ"""
-    return render_template('index.html')
+    return render_template('index.html', fast_available=student_available())
 
 
 @app.route('/predict', methods=['POST'])
+@admission_controlled
+@profiled
 def predict():
     """Xử lý upload và dự đoán ảnh"""
     if 'file' not in request.files:
@@ -244,13 +1162,38 @@ def predict():
         return redirect(url_for('index'))
     
     if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
+        filename = upload_filename(file.filename)
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
         file.save(filepath)
         
+        # Cho phép bật TTA theo từng request (mặc định theo cấu hình)
+        tta = request.form.get('tta') == '1' or None
+        # Chế độ nhanh: model student distill từ ensemble
+        fast = request.form.get('model') == 'fast'
+        # Cho phép chia tile ảnh toàn cảnh theo từng request (mặc định theo cấu hình)
+        tiled = request.form.get('tiled') == '1' or None
+        
+        if request.args.get('stream'):
+            # Chế độ streaming: trả kết quả từng phần qua server-sent events
+            return Response(stream_with_context(
+                                stream_prediction(filepath, filename, tta, fast, tiled)),
+                            mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache',
+                                     'X-Accel-Buffering': 'no'})
+        
         try:
-            # Kiểm tra xem ảnh có phải X-quang nha khoa không
-            is_valid, confidence_score, reason = is_dental_xray(filepath)
+            # Ảnh đã phân tích trước đó (cùng nội dung, cùng phiên bản models) -> dùng lại kết quả
+            model_set = get_prediction_models(fast)
+            image_hash = compute_image_hash(filepath)
+            # Bản đồ theo vùng không được lưu -> ảnh chia tile luôn chạy lại
+            tiled = should_use_tiling(filepath, tiled)
+            cached = None if tiled else find_cached_result(image_hash, model_set)
+            if cached is not None:
+                return render_result(filename, cached)
+            
+            # Decode + kiểm tra X-quang nha khoa (chạy trong process pool)
+            stage = run_cv_stage(filepath, with_features=False)
+            is_valid, confidence_score, reason = stage['is_valid'], stage['confidence'], stage['reason']
             
             if not is_valid:
                 # Ảnh không hợp lệ - hiển thị thông báo
@@ -259,34 +1202,24 @@ def predict():
                                      reason=reason,
                                      confidence=f"{confidence_score:.1f}")
             
-            # Dự đoán bệnh bằng ML model
-            result = predict_image(filepath)
+            # Ảnh gần trùng (xuất lại, resize, nén lại) với ảnh đã phân tích -> dùng lại hoặc đánh dấu
+            reused, near_duplicate = (None, None) if tiled else reuse_near_duplicate(
+                stage['perceptual_hash'], model_set)
+            if reused is not None:
+                return render_result(filename, reused)
             
-            # Phân tích đặc trưng ảnh để đánh giá mức độ nghiêm trọng
-            image_features = analyze_image_features(filepath)
-            severity_level = classify_severity_level(
-                image_features['severity_score'],
-                result['class']
-            )
+            # Phân tích đặc trưng ảnh trong process pool song song với dự đoán bằng ML model
+            image_features = start_feature_stage(filepath)
+            result = predict_image(filepath, tta, stage['model_input'], fast, tiled=tiled)
+            result['perceptual_hash'] = stage['perceptual_hash']
+            if near_duplicate is not None:
+                result['near_duplicate'] = near_duplicate
             
-            # Lấy lời khuyên y khoa
-            medical_advice = get_medical_advice(result['class'], severity_level)
+            # Đánh giá mức độ nghiêm trọng từ đặc trưng ảnh + lời khuyên y khoa
+            add_severity_analysis(filepath, result, image_features())
+            save_result(image_hash, result, filename)
             
-            # Thêm thông tin mới vào result
-            result['severity_level'] = severity_level
-            result['severity_score'] = image_features['severity_score']
-            result['image_features'] = image_features
-            result['medical_advice'] = medical_advice
-            
-            return render_template('result.html',
-                                 filename=filename,
-                                 prediction=result['class_vn'],
-                                 confidence=f"{result['confidence']:.2f}",
-                                 probabilities=result['probabilities'],
-                                 severity_level=severity_level,
-                                 severity_score=f"{image_features['severity_score']:.1f}",
-                                 medical_advice=medical_advice,
-                                 image_features=image_features)
+            return render_result(filename, result)
         
         except Exception as e:
             flash(f'Lỗi khi xử lý ảnh: {str(e)}', 'error')
@@ -297,7 +1230,68 @@ def predict():
         return redirect(url_for('index'))
 
 
+@app.route('/admin/profile', methods=['GET', 'POST', 'DELETE'])
+def admin_profile():
+    """
+    Profiling theo yêu cầu cho các request /predict tiếp theo (cần header X-Admin-Token)
+    
+    POST: bật cho N request (JSON/form: requests, tf_trace=0 để bỏ trace TensorFlow)
+    DELETE: tắt; GET: trạng thái và tóm tắt hot spots của các request đã profile
+    """
+    require_admin()
+    
+    if request.method == 'POST':
+        params = request.get_json(silent=True) or request.form
+        try:
+            num_requests = int(params.get('requests', 1))
+        except (TypeError, ValueError):
+            num_requests = 0
+        if not 1 <= num_requests <= 100:
+            return jsonify({'error': 'requests phải trong khoảng 1-100'}), 400
+        request_profiler.start(num_requests, trace_tf=str(params.get('tf_trace', '1')) != '0')
+    elif request.method == 'DELETE':
+        request_profiler.stop()
+    
+    return jsonify(request_profiler.status())
+
+
+@app.route('/history')
+def history():
+    """
+    Tra cứu lịch sử kết quả (JSON) - chứa dữ liệu bệnh nhân, cần X-Admin-Token
+    
+    Query params: hash, class, since, until (unix timestamp), limit (1..500), offset (>= 0)
+    """
+    require_admin()
+    store = get_results_store()
+    if store is None:
+        return jsonify({'error': 'Results store đang tắt'}), 404
+    
+    try:
+        since = request.args.get('since', type=float)
+        until = request.args.get('until', type=float)
+        offset = request.args.get('offset', 0, type=int)
+        if offset < 0:
+            return jsonify({'error': 'offset phải >= 0'}), 400
+        records = store.query_history(
+            image_hash=request.args.get('hash'),
+            predicted_class=request.args.get('class'),
+            since=since,
+            until=until,
+            # SQLite coi LIMIT âm là không giới hạn
+            limit=max(1, min(request.args.get('limit', 50, type=int), 500)),
+            offset=offset
+        )
+        return jsonify({
+            'results': records,
+            'class_counts': store.class_counts(since, until)
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+
 @app.route('/compare_models', methods=['GET', 'POST'])
+@admission_controlled
 def compare_models():
     """So sánh kết quả giữa CBAM Ensemble và ResNet50"""
     if request.method == 'POST':
@@ -312,15 +1306,15 @@ def compare_models():
             return redirect(url_for('compare_models'))
         
         if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], f"compare_models_{filename}")
+            filename = upload_filename(file.filename, prefix='compare_models_')
+            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
             file.save(filepath)
             
             try:
                 # Dự đoán với CBAM Ensemble
                 cbam_result = predict_image(filepath)
                 cbam_result['model_name'] = 'CBAM Ensemble'
-                cbam_result['model_desc'] = f'{len(loaded_models)} models với CBAM + Focal Loss'
+                cbam_result['model_desc'] = f"{len(cbam_result['model_versions'])} models với CBAM + Focal Loss"
                 
                 # Dự đoán với ResNet50
                 resnet_result = predict_with_resnet50(filepath)
@@ -334,7 +1328,7 @@ def compare_models():
                 }
                 
                 return render_template('compare_models.html',
-                                     filename=f"compare_models_{filename}",
+                                     filename=filename,
                                      cbam_result=cbam_result,
                                      resnet_result=resnet_result,
                                      comparison=comparison,
@@ -361,7 +1355,8 @@ if __name__ == '__main__':
     print("🦷 KHỞI ĐỘNG ỨNG DỤNG NHẬN DIỆN BỆNH RĂNG")
     print("="*50)
     try:
-        load_ensemble_models()
+        get_ensemble()
+        warmup_cv_pool(app.config['CV_POOL_WORKERS'])
         print("\n🚀 Server đang chạy tại: http://127.0.0.1:5000")
         print("="*50 + "\n")
         # Sử dụng cổng từ biến môi trường cho production (Render)
@@ -0,0 +1,249 @@
+"""
+Entry point ASGI cho app (chạy bằng uvicorn), cùng routes/templates với app_keras3.py
+- Body request (file upload tối đa MAX_CONTENT_LENGTH) được đọc bất đồng bộ trên event loop:
+  client upload chậm không giữ thread nào
+- Khi đã nhận đủ body, Flask app chạy trong thread pool riêng: inference (POST /predict,
+  /compare_models) và các route nhẹ (trang, static, /history, /metrics) dùng 2 pool khác nhau
+- Pool inference đầy thì trả 503 + Retry-After ngay (kiểm tra trước và sau khi đọc body);
+  request đang upload không chiếm slot nào
+
+Cách dùng:
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5000 --workers 2
+"""
+import asyncio
+import io
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from app_keras3 import app as flask_app, get_ensemble
+from cv_pipeline import warmup_cv_pool, shutdown_cv_pool
+
+
+INFERENCE_PATHS = ('/predict', '/compare_models')
+
+inference_executor = ThreadPoolExecutor(flask_app.config['ASGI_INFERENCE_THREADS'],
+                                        thread_name_prefix='inference')
+io_executor = ThreadPoolExecutor(flask_app.config['ASGI_IO_THREADS'], thread_name_prefix='io')
+# Số request inference đã giao cho inference_executor (không tính request đang upload body),
+# chỉ sửa trên event loop
+inference_running = 0
+_END = object()
+
+
+def is_inference_request(scope):
+    return scope['method'] == 'POST' and scope['path'] in INFERENCE_PATHS
+
+
+def build_environ(scope, body):
+    """Tạo WSGI environ từ ASGI scope và body đã đọc đủ"""
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+
+    for name, value in scope['headers']:
+        name, value = name.decode('latin-1'), value.decode('latin-1')
+        if name == 'content-length':
+            continue
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+            continue
+        key = 'HTTP_' + name.upper().replace('-', '_')
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def send_simple_response(send, status, message, headers=()):
+    body = message.encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'text/plain; charset=utf-8'),
+                    (b'content-length', str(len(body)).encode())] + list(headers)
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_overloaded(send):
+    await send_simple_response(
+        send, 503, 'Máy chủ đang quá tải, vui lòng thử lại sau ít giây',
+        [(b'retry-after', str(flask_app.config['ADMISSION_RETRY_AFTER']).encode())])
+
+
+async def read_body(receive, limit):
+    """
+    Đọc toàn bộ body (bất đồng bộ)
+
+    Returns:
+        bytes, hoặc None nếu vượt limit / client ngắt kết nối
+    """
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if limit and size > limit:
+            return None
+        chunks.append(chunk)
+        if not message.get('more_body', False):
+            return b''.join(chunks)
+
+
+def start_wsgi(environ):
+    """Gọi Flask app, trả về (status, headers, iterable body)"""
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                               for name, value in headers]
+
+    iterable = flask_app.wsgi_app(environ, start_response)
+    return response['status'], response['headers'], iterable
+
+
+def drain_wsgi(environ, loop, queue, cancelled):
+    """
+    Chạy Flask app và lấy toàn bộ body trong cùng một thread của executor
+    (context của stream_with_context gắn với thread đã push nó), đẩy từng phần vào queue của event loop:
+    (status, headers), các chunk, rồi _END hoặc exception
+    """
+    def put(item):
+        loop.call_soon_threadsafe(queue.put_nowait, item)
+
+    try:
+        status, headers, iterable = start_wsgi(environ)
+        put((status, headers))
+        try:
+            for chunk in iterable:
+                # Client đã ngắt kết nối: dừng ở chunk tiếp theo
+                if cancelled.is_set():
+                    break
+                if chunk:
+                    put(chunk)
+        finally:
+            # Đóng response (vd: trả slot admission control của response streaming)
+            if hasattr(iterable, 'close'):
+                iterable.close()
+    except Exception as e:
+        put(e)
+    else:
+        put(_END)
+
+
+async def next_item(queue):
+    item = await queue.get()
+    if isinstance(item, Exception):
+        raise item
+    return item
+
+
+async def run_wsgi(scope, body, send, executor):
+    """Chạy Flask app trong executor và gửi response (kể cả streaming SSE) về client"""
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    cancelled = threading.Event()
+    task = loop.run_in_executor(executor, drain_wsgi, build_environ(scope, body),
+                                loop, queue, cancelled)
+    try:
+        status, headers = await next_item(queue)
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        while (chunk := await next_item(queue)) is not _END:
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        cancelled.set()
+        # Chờ thread trả response (slot của executor được tính tới khi request thực sự xong)
+        await task
+
+
+async def handle_http(scope, receive, send):
+    global inference_running
+
+    limit = flask_app.config['MAX_CONTENT_LENGTH']
+    content_length = dict(scope['headers']).get(b'content-length')
+    try:
+        content_length = int(content_length) if content_length else None
+    except ValueError:
+        await send_simple_response(send, 400, 'Content-Length không hợp lệ')
+        return
+    if limit and content_length and content_length > limit:
+        await send_simple_response(send, 413, 'File quá lớn')
+        return
+
+    if not is_inference_request(scope):
+        body = await read_body(receive, limit)
+        if body is None:
+            await send_simple_response(send, 413, 'File quá lớn')
+            return
+        await run_wsgi(scope, body, send, io_executor)
+        return
+
+    # Kiểm tra trước khi đọc body (pool đang đầy thì không nhận upload) và sau khi đọc xong
+    if inference_running >= flask_app.config['ASGI_INFERENCE_THREADS']:
+        await send_overloaded(send)
+        return
+    body = await read_body(receive, limit)
+    if body is None:
+        await send_simple_response(send, 413, 'File quá lớn')
+        return
+    if inference_running >= flask_app.config['ASGI_INFERENCE_THREADS']:
+        await send_overloaded(send)
+        return
+
+    inference_running += 1
+    try:
+        await run_wsgi(scope, body, send, inference_executor)
+    finally:
+        inference_running -= 1
+
+
+async def handle_lifespan(receive, send):
+    loop = asyncio.get_running_loop()
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                os.makedirs(flask_app.config['UPLOAD_FOLDER'], exist_ok=True)
+                await loop.run_in_executor(inference_executor, get_ensemble)
+                await loop.run_in_executor(io_executor, warmup_cv_pool,
+                                           flask_app.config['CV_POOL_WORKERS'])
+            except Exception as e:
+                await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                return
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            inference_executor.shutdown(wait=False, cancel_futures=True)
+            io_executor.shutdown(wait=False, cancel_futures=True)
+            shutdown_cv_pool()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """ASGI application"""
+    if scope['type'] == 'http':
+        await handle_http(scope, receive, send)
+    elif scope['type'] == 'lifespan':
+        await handle_lifespan(receive, send)
@@ -0,0 +1,117 @@
+"""
+Benchmark forward pass của CBAM ensemble theo từng chế độ inference
+- predict: keras model.predict trên model gốc, input float32 đã preprocess (cách cũ, làm mốc)
+- app: hàm dự đoán của app với XLA_ENABLED=0 (predict_on_batch, input uint8, preprocess trong graph)
+- app-xla: hàm dự đoán của app với XLA_ENABLED=1 (CompiledPredictor theo XLA_BATCH_BUCKETS, input uint8)
+
+Cách dùng:
+    python benchmark_inference.py
+    python benchmark_inference.py --batch-sizes 1 4 8 --runs 50 --json bench.json
+    python benchmark_inference.py --precision bfloat16
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from app_keras3 import app, get_ensemble, build_predict_fns, resolve_precision
+
+
+MODES = ('predict', 'app', 'app-xla')
+
+
+def make_predict_fns(model_set, mode, precision):
+    """Hàm dự đoán cho từng model trong ensemble theo chế độ"""
+    if mode == 'predict':
+        return [lambda x, model=model: model.predict(x, batch_size=len(x), verbose=0)
+                for model in model_set.models]
+    if mode in ('app', 'app-xla'):
+        xla_enabled = app.config['XLA_ENABLED']
+        app.config['XLA_ENABLED'] = mode == 'app-xla'
+        try:
+            return build_predict_fns(model_set, precision)
+        finally:
+            app.config['XLA_ENABLED'] = xla_enabled
+    raise ValueError(f"Chế độ không hợp lệ: {mode} (chọn {', '.join(MODES)})")
+
+
+def make_batch(mode, batch_size):
+    """Batch ngẫu nhiên đúng kiểu input của chế độ (float32 [-1, 1] hoặc ảnh uint8)"""
+    rng = np.random.default_rng(0)
+    if mode == 'predict':
+        return rng.uniform(-1, 1, (batch_size, 224, 224, 3)).astype(np.float32)
+    return rng.integers(0, 256, (batch_size, 224, 224, 3), dtype=np.uint8)
+
+
+def benchmark(predict_fns, x, runs):
+    """
+    Thời gian (ms) chạy toàn bộ ensemble trên một batch
+
+    Returns:
+        dict: mean/p50/p95 (ms) và số ảnh/giây
+    """
+    # Warm up (trace/biên dịch)
+    for predict_fn in predict_fns:
+        predict_fn(x)
+
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        for predict_fn in predict_fns:
+            predict_fn(x)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    timings = np.array(timings)
+    return {
+        'mean_ms': float(timings.mean()),
+        'p50_ms': float(np.percentile(timings, 50)),
+        'p95_ms': float(np.percentile(timings, 95)),
+        'images_per_sec': float(len(x) * 1000 / timings.mean())
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark các chế độ inference của CBAM ensemble')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=MODES)
+    parser.add_argument('--precision', help='float32 hoặc bfloat16 (mặc định theo INFERENCE_PRECISION)')
+    parser.add_argument('--runs', type=int, default=30)
+    parser.add_argument('--json', help='Lưu kết quả ra file JSON')
+    args = parser.parse_args()
+
+    model_set = get_ensemble()
+    precision = resolve_precision(args.precision)
+    print(f"🧠 {model_set.name}: {model_set.version} ({precision})\n")
+
+    predict_fns = {}
+    for mode in args.modes:
+        try:
+            predict_fns[mode] = make_predict_fns(model_set, mode, precision)
+        except Exception as e:
+            print(f"{mode}: lỗi khi tạo hàm dự đoán: {e}")
+
+    results = []
+    print(f"{'batch':>5} {'mode':>10} {'mean ms':>10} {'p95 ms':>10} {'img/s':>8} {'speedup':>8}")
+    for batch_size in args.batch_sizes:
+        baseline = None
+        for mode, fns in predict_fns.items():
+            try:
+                stats = benchmark(fns, make_batch(mode, batch_size), args.runs)
+            except Exception as e:
+                print(f"{batch_size:>5} {mode:>10} lỗi: {e}")
+                continue
+            baseline = baseline or stats['mean_ms']
+            stats.update(batch_size=batch_size, mode=mode, speedup=baseline / stats['mean_ms'])
+            results.append(stats)
+            print(f"{batch_size:>5} {mode:>10} {stats['mean_ms']:>10.1f} {stats['p95_ms']:>10.1f} "
+                  f"{stats['images_per_sec']:>8.1f} {stats['speedup']:>7.2f}x")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'versions': list(model_set.versions), 'precision': precision,
+                       'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
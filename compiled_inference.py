@@ -0,0 +1,115 @@
+"""
+Forward pass được biên dịch (tf.function, tùy chọn XLA jit_compile) cho inference trên CPU
+- Mỗi kích thước batch cố định (bucket) được trace/biên dịch một lần và warm up trước
+- Batch thực tế được pad lên bucket gần nhất để dùng lại bản đã biên dịch
+- Nếu biên dịch XLA lỗi cho một model thì tự chuyển về tf.function thường
+"""
+import threading
+
+import numpy as np
+import tensorflow as tf
+
+import metrics
+
+
+DEFAULT_BATCH_BUCKETS = (1, 2, 4, 8)
+MODEL_INPUT_SHAPE = (224, 224, 3)
+
+
+class CompiledPredictor:
+    """
+    Hàm dự đoán đã biên dịch cho một keras.Model
+
+    Args:
+        model: keras.Model
+        buckets: Các kích thước batch được biên dịch sẵn
+        jit_compile: Dùng XLA (True) hay tf.function thường (False)
+        name: Tên hiển thị trong metrics
+        input_dtype: Kiểu dữ liệu input (np.uint8 cho model có preprocess trong graph)
+    """
+
+    def __init__(self, model, buckets=DEFAULT_BATCH_BUCKETS, jit_compile=True, name=None,
+                 input_dtype=np.float32):
+        self.model = model
+        self.input_dtype = input_dtype
+        self.buckets = tuple(sorted(set(buckets)))
+        self.name = name or model.name
+        self.jit_compile = jit_compile
+        self.compiled_buckets = set()
+        self._lock = threading.Lock()
+        self._fn = self._make_fn(jit_compile)
+
+    def _make_fn(self, jit_compile):
+        model = self.model
+
+        @tf.function(jit_compile=jit_compile, reduce_retracing=False)
+        def forward(x):
+            return model(x, training=False)
+
+        return forward
+
+    def _fallback(self, error):
+        """Chuyển về tf.function không XLA sau khi biên dịch lỗi"""
+        with self._lock:
+            if not self.jit_compile:
+                return
+            self.jit_compile = False
+            self._fn = self._make_fn(False)
+            self.compiled_buckets.clear()
+        metrics.record_event('xla_fallback', model=self.name, error=str(error)[:500])
+        print(f"⚠ XLA compile failed for {self.name}, using tf.function: {error}")
+
+    def tracing_count(self):
+        """Số lần trace/biên dịch (tăng sau warmup = đang retrace)"""
+        return self._fn.experimental_get_tracing_count()
+
+    def bucket_for(self, batch_size):
+        """Bucket nhỏ nhất chứa được batch (tối đa bucket lớn nhất)"""
+        for bucket in self.buckets:
+            if bucket >= batch_size:
+                return bucket
+        return self.buckets[-1]
+
+    def _run(self, batch):
+        try:
+            return self._fn(batch).numpy()
+        except Exception as e:
+            if not self.jit_compile:
+                raise
+            self._fallback(e)
+            return self._fn(batch).numpy()
+
+    def warmup(self, input_shape=MODEL_INPUT_SHAPE):
+        """Biên dịch trước tất cả bucket"""
+        for bucket in self.buckets:
+            self._run(np.zeros((bucket,) + tuple(input_shape), dtype=self.input_dtype))
+            self.compiled_buckets.add(bucket)
+        metrics.record_event('compiled_warmup', model=self.name, xla=self.jit_compile,
+                             buckets=list(self.buckets))
+        return self
+
+    def __call__(self, x):
+        """
+        Dự đoán cho batch bất kỳ kích thước (pad lên bucket, chia nhỏ nếu lớn hơn bucket lớn nhất)
+
+        Returns:
+            np.ndarray: Output của model, cùng số phần tử với x
+        """
+        x = np.asarray(x, dtype=self.input_dtype)
+        max_bucket = self.buckets[-1]
+        outputs = []
+
+        for start in range(0, len(x), max_bucket):
+            chunk = x[start:start + max_bucket]
+            size = len(chunk)
+            bucket = self.bucket_for(size)
+            if size < bucket:
+                padding = np.zeros((bucket - size,) + chunk.shape[1:], dtype=self.input_dtype)
+                chunk = np.concatenate([chunk, padding], axis=0)
+
+            if bucket not in self.compiled_buckets:
+                metrics.inc('compiled_inference.cold_bucket')
+                self.compiled_buckets.add(bucket)
+            outputs.append(self._run(chunk)[:size])
+
+        return np.concatenate(outputs, axis=0)
@@ -0,0 +1,289 @@
+"""
+Pipeline xử lý ảnh (CV stage) chạy trong process pool
+Decode ảnh, kiểm tra X-quang và phân tích đặc trưng (OpenCV/NumPy, CPU-bound) chạy ngoài process
+của server: khi server xử lý nhiều request cùng lúc (gthread, ASGI), CV stage của request này
+chạy song song với inference (TensorFlow) của request khác thay vì tranh GIL.
+Với một request đơn lẻ, CV stage vẫn chạy trước inference (không chồng lấp).
+"""
+import atexit
+import os
+import sys
+import threading
+import types
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing.context import SpawnContext, SpawnProcess
+
+import cv2
+from PIL import Image
+
+from image_analyzer import (XRAY_SCORE_THRESHOLD, analyze_image_features_array,
+                            is_dental_xray_array)
+from perceptual_hash import compute_phash
+
+
+MODEL_INPUT_SIZE = (224, 224)
+# Cạnh ngắn tối thiểu của ảnh decode thu nhỏ (kiểm tra X-quang, model input, pHash)
+DECODE_MIN_SIDE = min(MODEL_INPUT_SIZE)
+# Decode thu nhỏ 1/8, 1/4, 1/2 (JPEG: libjpeg scale ngay trong miền DCT, không decode ảnh gốc)
+REDUCED_DECODE_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2)
+)
+# Điểm X-quang trên ảnh thu nhỏ cách ngưỡng ít hơn mức này -> kiểm tra lại trên ảnh gốc
+# (thu nhỏ làm giảm nhiễu, điểm brightness/contrast có thể lệch vài điểm)
+XRAY_RECHECK_MARGIN = 15
+
+# Process pool dùng chung trong một worker (khởi tạo khi cần)
+_cv_pool = None
+_cv_pool_workers = None
+_cv_pool_lock = threading.Lock()
+# Thay cho __main__ khi spawn process con (không có __file__/__spec__)
+_LIGHT_MAIN = types.ModuleType('__mp_main__')
+_spawn_lock = threading.Lock()
+
+
+def reduced_decode_flag(width, height, min_side=DECODE_MIN_SIDE):
+    """
+    Chọn mức decode thu nhỏ lớn nhất mà cạnh ngắn vẫn >= min_side
+
+    Returns:
+        tuple: (factor, cv2 imread flag)
+    """
+    for factor, flag in REDUCED_DECODE_FLAGS:
+        if min(width, height) // factor >= min_side:
+            return factor, flag
+    return 1, cv2.IMREAD_COLOR
+
+
+def decode_reduced(img_path, min_side=DECODE_MIN_SIDE):
+    """
+    Decode ảnh BGR ở độ phân giải nhỏ nhất mà cạnh ngắn vẫn >= min_side
+
+    Returns:
+        tuple: (np.ndarray uint8 (H, W, 3) hoặc None nếu không đọc được, hệ số thu nhỏ)
+    """
+    try:
+        # Chỉ đọc header để biết kích thước
+        with Image.open(img_path) as img:
+            width, height = img.size
+    except Exception:
+        return cv2.imread(img_path), 1
+
+    factor, flag = reduced_decode_flag(width, height, min_side)
+    return cv2.imread(img_path, flag), factor
+
+
+def model_input_from_bgr(img):
+    """Mảng RGB uint8 (224, 224, 3) cho model từ ảnh BGR đã decode"""
+    if img.shape[1::-1] != MODEL_INPUT_SIZE:
+        img = cv2.resize(img, MODEL_INPUT_SIZE, interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+def load_model_input(img_path):
+    """
+    Decode thu nhỏ ảnh thành model input (224, 224, 3) - cùng cách với CV stage
+
+    Raises:
+        ValueError: Không đọc được ảnh
+    """
+    img, _ = decode_reduced(img_path)
+    if img is None:
+        raise ValueError(f"Không thể đọc file ảnh: {img_path}")
+    return model_input_from_bgr(img)
+
+
+def run_validity_stage(img_path):
+    """
+    Kiểm tra X-quang, model input và pHash từ một lần decode thu nhỏ (chạy trong process con)
+    Ảnh có điểm gần ngưỡng được kiểm tra lại trên ảnh gốc
+
+    Returns:
+        dict: Giống run_cv_stage, 'image_features' luôn None
+    """
+    stage = {
+        'is_valid': False,
+        'confidence': 0.0,
+        'reason': '',
+        'model_input': None,
+        'image_features': None,
+        'perceptual_hash': None
+    }
+
+    try:
+        img, factor = decode_reduced(img_path)
+        if img is None:
+            stage['reason'] = "Không thể đọc file ảnh"
+            return stage
+
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        is_valid, confidence, reason = is_dental_xray_array(img, gray)
+        if factor > 1 and abs(confidence - XRAY_SCORE_THRESHOLD) < XRAY_RECHECK_MARGIN:
+            is_valid, confidence, reason = is_dental_xray_array(cv2.imread(img_path))
+        stage.update(is_valid=bool(is_valid), confidence=float(confidence), reason=reason)
+        if not is_valid:
+            return stage
+
+        stage['model_input'] = model_input_from_bgr(img)
+        stage['perceptual_hash'] = compute_phash(gray)
+
+    except Exception as e:
+        stage.update(is_valid=False, confidence=0.0, reason=f"Lỗi khi phân tích ảnh: {str(e)}")
+
+    return stage
+
+
+def run_feature_stage(img_path):
+    """
+    analyze_image_features trên ảnh decode ở độ phân giải gốc
+    (các đặc trưng như edge_intensity phụ thuộc độ phân giải)
+    """
+    img = cv2.imread(img_path)
+    if img is None:
+        raise ValueError(f"Không thể đọc file ảnh: {img_path}")
+    return analyze_image_features_array(img)
+
+
+def run_cv_stage(img_path, with_features=True):
+    """
+    Toàn bộ phần CPU-bound cho một ảnh (chạy trong process con)
+
+    Args:
+        img_path: Đường dẫn ảnh
+        with_features: Có tính analyze_image_features không (chỉ khi ảnh hợp lệ)
+
+    Returns:
+        dict: {
+            'is_valid': bool,
+            'confidence': float,
+            'reason': str,
+            'model_input': np.ndarray uint8 (224, 224, 3) hoặc None,
+            'image_features': dict hoặc None,
+            'perceptual_hash': str (pHash hex) hoặc None
+        }
+    """
+    stage = run_validity_stage(img_path)
+    if stage['is_valid'] and with_features:
+        try:
+            stage['image_features'] = run_feature_stage(img_path)
+        except Exception as e:
+            stage.update(is_valid=False, reason=f"Lỗi khi phân tích ảnh: {str(e)}")
+    return stage
+
+
+def _warmup():
+    """Task rỗng để khởi động process con trước khi có request"""
+    return os.getpid()
+
+
+class _LightSpawnProcess(SpawnProcess):
+    """
+    Process spawn không import lại script chính của process cha
+    (vd: `python app_keras3.py` -> TensorFlow, models, watcher thread trong mỗi process con).
+    Process con chỉ import cv_pipeline khi nhận task.
+    """
+
+    def start(self):
+        # multiprocessing đọc sys.modules['__main__'] khi tạo dữ liệu khởi tạo cho process con,
+        # chỉ thay trong lúc start (vài ms)
+        with _spawn_lock:
+            main_module = sys.modules['__main__']
+            sys.modules['__main__'] = _LIGHT_MAIN
+            try:
+                super().start()
+            finally:
+                sys.modules['__main__'] = main_module
+
+
+class _LightSpawnContext(SpawnContext):
+    Process = _LightSpawnProcess
+
+
+def get_cv_pool(max_workers=None):
+    """
+    Lấy process pool cho CV stage
+
+    Args:
+        max_workers: Số process (None = số core, 0 = không dùng pool)
+
+    Returns:
+        ProcessPoolExecutor hoặc None nếu tắt pool
+    """
+    global _cv_pool, _cv_pool_workers
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if max_workers <= 0:
+        return None
+
+    with _cv_pool_lock:
+        if _cv_pool is None or _cv_pool_workers != max_workers:
+            _shutdown_cv_pool()
+            # spawn: process con không kế thừa trạng thái TensorFlow của process cha
+            _cv_pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=_LightSpawnContext())
+            _cv_pool_workers = max_workers
+        return _cv_pool
+
+
+def warmup_cv_pool(max_workers=None):
+    """Khởi động trước các process con (tránh độ trễ spawn ở request đầu tiên)"""
+    pool = get_cv_pool(max_workers)
+    if pool is not None:
+        futures = [pool.submit(_warmup) for _ in range(max_workers or os.cpu_count() or 1)]
+        for future in futures:
+            future.result()
+
+
+def _shutdown_cv_pool():
+    global _cv_pool, _cv_pool_workers
+
+    if _cv_pool is not None:
+        _cv_pool.shutdown(wait=False, cancel_futures=True)
+    _cv_pool = None
+    _cv_pool_workers = None
+
+
+def shutdown_cv_pool():
+    """Đóng process pool"""
+    with _cv_pool_lock:
+        _shutdown_cv_pool()
+
+
+atexit.register(shutdown_cv_pool)
+
+
+def submit_cv_stage(img_path, with_features=True, max_workers=None):
+    """
+    Gửi CV stage của một ảnh vào process pool
+
+    Returns:
+        Future: kết quả của run_cv_stage (chạy ngay trong thread hiện tại nếu tắt pool)
+    """
+    pool = get_cv_pool(max_workers)
+    if pool is None:
+        future = Future()
+        future.set_result(run_cv_stage(img_path, with_features))
+        return future
+
+    return pool.submit(run_cv_stage, img_path, with_features)
+
+
+def submit_feature_stage(img_path, max_workers=None):
+    """
+    Gửi analyze_image_features của một ảnh vào process pool (chạy song song với inference)
+
+    Returns:
+        Future: kết quả của run_feature_stage (chạy ngay trong thread hiện tại nếu tắt pool)
+    """
+    pool = get_cv_pool(max_workers)
+    if pool is None:
+        future = Future()
+        try:
+            future.set_result(run_feature_stage(img_path))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    return pool.submit(run_feature_stage, img_path)
+
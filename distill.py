@@ -0,0 +1,285 @@
+"""
+Distill CBAM Ensemble (4 models) thành một model student duy nhất
+- Teacher: ensemble đang dùng trong app (trung bình softmax của v1-v4)
+- Student: MobileNetV2 (cùng preprocess_input) + cbam_block, có thể dùng alpha nhỏ hơn cho nhẹ
+- Dữ liệu: thư mục ảnh không cần nhãn; nhãn mềm lấy từ teacher
+- Kết quả: models/best_teeth_student.h5 + báo cáo so sánh với ensemble (JSON)
+
+Cách dùng:
+    python distill.py --images data/unlabeled
+    python distill.py --images data/unlabeled --labeled data/test --alpha 0.5 --epochs 20
+    (data/test gồm các thư mục con Caries/, Fractured/, Normal/ để tính accuracy)
+"""
+import argparse
+import json
+import os
+import time
+os.environ['KERAS_BACKEND'] = 'tensorflow'
+
+import numpy as np
+import keras
+from keras import ops
+from keras.layers import GlobalAveragePooling2D, Dropout, Dense, Softmax
+from keras.applications import MobileNetV2
+from keras.applications.mobilenet_v2 import preprocess_input
+
+from app_keras3 import (CLASS_NAMES, STUDENT_MODEL_FILE, STUDENT_MODEL_NAME,
+                        get_ensemble, get_fused_ensemble, load_image_array, model_path_for)
+from custom_layers_keras3 import cbam_block
+from graph_preprocess import with_uint8_input
+
+
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg'}
+
+
+def list_images(folder):
+    """Tất cả ảnh trong thư mục (đệ quy, sắp xếp ổn định)"""
+    paths = []
+    for root, _, files in os.walk(folder):
+        for name in files:
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                paths.append(os.path.join(root, name))
+    return sorted(paths)
+
+
+def list_labeled_images(folder):
+    """Ảnh có nhãn: thư mục con trùng tên CLASS_NAMES"""
+    paths, labels = [], []
+    for idx, class_name in enumerate(CLASS_NAMES):
+        class_paths = list_images(os.path.join(folder, class_name))
+        paths.extend(class_paths)
+        labels.extend([idx] * len(class_paths))
+    return paths, np.array(labels, dtype=np.int64)
+
+
+def load_batch(paths):
+    """Load ảnh thành batch float32 (N, 224, 224, 3), giá trị 0-255"""
+    return np.stack([load_image_array(path) for path in paths]).astype(np.float32)
+
+
+def predict_paths(model, paths, batch_size):
+    """Dự đoán xác suất cho danh sách ảnh theo batch (model nhận ảnh uint8, preprocess trong graph)"""
+    probs = []
+    for start in range(0, len(paths), batch_size):
+        batch = np.stack([load_image_array(path) for path in paths[start:start + batch_size]])
+        probs.append(model.predict(batch, batch_size=len(batch), verbose=0))
+    return np.concatenate(probs, axis=0)
+
+
+class DistillDataset(keras.utils.PyDataset):
+    """Batch (ảnh đã preprocess, xác suất của teacher), có lật ngang ngẫu nhiên khi train"""
+
+    def __init__(self, paths, targets, batch_size, augment=False, seed=0, **kwargs):
+        super().__init__(**kwargs)
+        self.paths = paths
+        self.targets = targets
+        self.batch_size = batch_size
+        self.augment = augment
+        self.rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        return int(np.ceil(len(self.paths) / self.batch_size))
+
+    def __getitem__(self, idx):
+        start = idx * self.batch_size
+        end = min(start + self.batch_size, len(self.paths))
+        x = load_batch(self.paths[start:end])
+        if self.augment:
+            flip = self.rng.random(len(x)) < 0.5
+            x[flip] = x[flip, :, ::-1, :]
+        return preprocess_input(x), self.targets[start:end]
+
+
+class DistillationLoss(keras.losses.Loss):
+    """
+    Cross-entropy giữa xác suất teacher và logits student, làm mềm bằng temperature
+    (tương đương KL divergence, nhân T^2 để giữ độ lớn gradient)
+    """
+
+    def __init__(self, temperature=2.0, name='distillation_loss', **kwargs):
+        super().__init__(name=name, **kwargs)
+        self.temperature = temperature
+
+    def call(self, y_true, y_pred):
+        t = self.temperature
+        teacher = ops.softmax(ops.log(ops.clip(y_true, 1e-7, 1.0)) / t, axis=-1)
+        student = ops.log_softmax(y_pred / t, axis=-1)
+        return -ops.sum(teacher * student, axis=-1) * (t * t)
+
+    def get_config(self):
+        config = super().get_config()
+        config.update({'temperature': self.temperature})
+        return config
+
+
+def build_student(alpha=1.0, use_cbam=True, weights='imagenet'):
+    """
+    Student: MobileNetV2 backbone (+ cbam_block) + GAP + Dense, output là logits
+    """
+    inputs = keras.Input(shape=(224, 224, 3))
+    backbone = MobileNetV2(include_top=False, weights=weights,
+                           input_shape=(224, 224, 3), alpha=alpha)
+    x = backbone(inputs)
+    if use_cbam:
+        x = cbam_block(x)
+    x = GlobalAveragePooling2D()(x)
+    x = Dropout(0.3)(x)
+    logits = Dense(len(CLASS_NAMES))(x)
+    return keras.Model(inputs, logits, name=f'{STUDENT_MODEL_NAME}_logits')
+
+
+def to_serving_model(student):
+    """Thêm softmax để model student có cùng output với các model trong ensemble"""
+    probs = Softmax()(student.output)
+    return keras.Model(student.input, probs, name=STUDENT_MODEL_NAME)
+
+
+def measure_latency(models, runs=20):
+    """Thời gian trung bình (ms) để chạy lần lượt các model trên 1 ảnh, giống predict_image"""
+    dummy = np.zeros((1, 224, 224, 3), dtype=np.float32)
+    for model in models:
+        model.predict(dummy, verbose=0)
+
+    start = time.perf_counter()
+    for _ in range(runs):
+        for model in models:
+            model.predict(dummy, verbose=0)
+    return (time.perf_counter() - start) / runs * 1000
+
+
+def compare_predictions(teacher_probs, student_probs, labels=None):
+    """Độ trùng khớp (và accuracy nếu có nhãn) giữa student và teacher"""
+    teacher_pred = teacher_probs.argmax(axis=1)
+    student_pred = student_probs.argmax(axis=1)
+
+    report = {
+        'num_images': int(len(teacher_probs)),
+        'agreement': float(np.mean(teacher_pred == student_pred)),
+        'mean_abs_prob_diff': float(np.mean(np.abs(teacher_probs - student_probs))),
+        'per_class_agreement': {
+            class_name: float(np.mean(student_pred[teacher_pred == idx] == idx))
+            for idx, class_name in enumerate(CLASS_NAMES)
+            if np.any(teacher_pred == idx)
+        }
+    }
+    if labels is not None:
+        report['teacher_accuracy'] = float(np.mean(teacher_pred == labels))
+        report['student_accuracy'] = float(np.mean(student_pred == labels))
+    return report
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Distill CBAM ensemble thành một model student')
+    parser.add_argument('--images', required=True, help='Thư mục ảnh không nhãn để distill')
+    parser.add_argument('--labeled', help='Thư mục ảnh có nhãn (Caries/Fractured/Normal) để đánh giá')
+    parser.add_argument('--output', default=model_path_for(STUDENT_MODEL_FILE),
+                        help='File .h5 của student')
+    parser.add_argument('--report', help='File báo cáo JSON (mặc định: <output>.report.json)')
+    parser.add_argument('--alpha', type=float, default=1.0,
+                        help='Độ rộng MobileNetV2 (0.35, 0.5, 0.75, 1.0, ...) - nhỏ hơn thì nhanh hơn')
+    parser.add_argument('--no-cbam', action='store_true', help='Không thêm cbam_block')
+    parser.add_argument('--weights', default='imagenet',
+                        help="Weights khởi tạo backbone ('imagenet' hoặc 'none')")
+    parser.add_argument('--epochs', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--learning-rate', type=float, default=1e-4)
+    parser.add_argument('--temperature', type=float, default=2.0)
+    parser.add_argument('--val-split', type=float, default=0.15)
+    parser.add_argument('--workers', type=int, default=4, help='Số thread load ảnh khi train')
+    parser.add_argument('--seed', type=int, default=42)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    keras.utils.set_random_seed(args.seed)
+
+    paths = list_images(args.images)
+    if len(paths) < 2:
+        raise SystemExit(f"Không đủ ảnh trong {args.images}")
+
+    rng = np.random.default_rng(args.seed)
+    paths = [paths[i] for i in rng.permutation(len(paths))]
+    num_val = max(1, int(len(paths) * args.val_split))
+    train_paths, val_paths = paths[num_val:], paths[:num_val]
+    print(f"📁 {len(train_paths)} ảnh train, {len(val_paths)} ảnh validation")
+
+    # 1. Nhãn mềm từ teacher (ensemble đã gộp - một lần forward cho mỗi batch)
+    teacher_set = get_ensemble()
+    fused = get_fused_ensemble(teacher_set)
+    print(f"🧠 Teacher: {teacher_set.name} ({teacher_set.version})")
+    teacher_train = predict_paths(fused, train_paths, args.batch_size)
+    teacher_val = predict_paths(fused, val_paths, args.batch_size)
+
+    # 2. Train student
+    weights = None if args.weights.lower() == 'none' else args.weights
+    student = build_student(args.alpha, not args.no_cbam, weights)
+    student.compile(optimizer=keras.optimizers.Adam(args.learning_rate),
+                    loss=DistillationLoss(args.temperature))
+
+    train_ds = DistillDataset(train_paths, teacher_train, args.batch_size, augment=True,
+                              seed=args.seed, workers=args.workers)
+    val_ds = DistillDataset(val_paths, teacher_val, args.batch_size, workers=args.workers)
+    history = student.fit(
+        train_ds,
+        validation_data=val_ds,
+        epochs=args.epochs,
+        callbacks=[keras.callbacks.EarlyStopping(patience=3, restore_best_weights=True)]
+    )
+
+    # 3. Lưu model student (output softmax giống các model trong ensemble)
+    serving = to_serving_model(student)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    serving.save(args.output)
+    print(f"💾 Đã lưu student: {args.output}")
+    # Student nhận ảnh uint8 giống khi serve trong app
+    serving_uint8 = with_uint8_input(serving)
+
+    # 4. Báo cáo so sánh với ensemble
+    report = {
+        'teacher': {'name': teacher_set.name, 'versions': list(teacher_set.versions)},
+        'student': {
+            'file': args.output,
+            'alpha': args.alpha,
+            'cbam': not args.no_cbam,
+            'params': int(serving.count_params()),
+            'teacher_params': int(sum(model.count_params() for model in teacher_set.models))
+        },
+        'training': {
+            'train_images': len(train_paths),
+            'val_images': len(val_paths),
+            'epochs_run': len(history.history['loss']),
+            'final_loss': float(history.history['loss'][-1]),
+            'final_val_loss': float(history.history['val_loss'][-1])
+        },
+        'validation': compare_predictions(teacher_val,
+                                          predict_paths(serving_uint8, val_paths, args.batch_size))
+    }
+
+    if args.labeled:
+        labeled_paths, labels = list_labeled_images(args.labeled)
+        if labeled_paths:
+            report['labeled'] = compare_predictions(
+                predict_paths(fused, labeled_paths, args.batch_size),
+                predict_paths(serving_uint8, labeled_paths, args.batch_size),
+                labels
+            )
+
+    teacher_ms = measure_latency(teacher_set.models)
+    student_ms = measure_latency([serving])
+    report['latency_ms_per_image'] = {
+        'teacher_ensemble': teacher_ms,
+        'student': student_ms,
+        'speedup': teacher_ms / student_ms
+    }
+
+    report_path = args.report or os.path.splitext(args.output)[0] + '.report.json'
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    print(f"📊 Báo cáo: {report_path}")
+
+
+if __name__ == '__main__':
+    main()
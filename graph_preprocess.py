@@ -0,0 +1,67 @@
+"""
+Resize và chuẩn hóa ảnh (preprocess_input) nằm ngay trong graph của model
+- Input là tensor uint8 (batch, H, W, 3) kích thước bất kỳ: mỗi ảnh chỉ cần một buffer uint8
+  dùng chung cho mọi model, không tạo bản sao float32 bằng NumPy
+- Tính toán tiền xử lý luôn float32 (kể cả khi model chạy bfloat16)
+"""
+import os
+os.environ['KERAS_BACKEND'] = 'tensorflow'
+
+import keras
+from keras import ops
+
+
+MODEL_INPUT_SIZE = (224, 224)
+# Mean BGR của keras.applications.resnet50.preprocess_input (mode 'caffe')
+RESNET50_BGR_MEAN = (103.939, 116.779, 123.68)
+PREPROCESS_MODES = ('mobilenet_v2', 'resnet50')
+
+
+class ImagePreprocess(keras.layers.Layer):
+    """
+    uint8 RGB (batch, H, W, 3) -> float32 (batch, 224, 224, 3) đã chuẩn hóa
+
+    Args:
+        mode: 'mobilenet_v2' ([-1, 1]) hoặc 'resnet50' (BGR trừ mean, 'caffe')
+        size: Kích thước input của model (height, width)
+    """
+
+    def __init__(self, mode='mobilenet_v2', size=MODEL_INPUT_SIZE, **kwargs):
+        kwargs.setdefault('dtype', 'float32')
+        super().__init__(**kwargs)
+        if mode not in PREPROCESS_MODES:
+            raise ValueError(f"Preprocess không hợp lệ: {mode} (chọn {', '.join(PREPROCESS_MODES)})")
+        self.mode = mode
+        self.size = tuple(size)
+
+    def call(self, images):
+        # Ảnh đúng kích thước (vd: model input từ CV stage) được giữ nguyên giá trị
+        x = ops.image.resize(ops.cast(images, 'float32'), self.size, interpolation='bilinear')
+        if self.mode == 'mobilenet_v2':
+            return x / 127.5 - 1.0
+        return ops.flip(x, axis=-1) - ops.convert_to_tensor(RESNET50_BGR_MEAN, dtype='float32')
+
+    def compute_output_shape(self, input_shape):
+        return (input_shape[0],) + self.size + (input_shape[-1],)
+
+    def get_config(self):
+        config = super().get_config()
+        config.update({'mode': self.mode, 'size': self.size})
+        return config
+
+
+def uint8_input(name='image'):
+    """Input uint8 kích thước bất kỳ"""
+    return keras.Input(shape=(None, None, 3), dtype='uint8', name=name)
+
+
+def with_uint8_input(model, mode='mobilenet_v2', size=MODEL_INPUT_SIZE):
+    """
+    Bọc model (input float đã preprocess) thành model nhận ảnh uint8 kích thước bất kỳ
+
+    Returns:
+        keras.Model: Cùng output với model gốc
+    """
+    inputs = uint8_input()
+    outputs = model(ImagePreprocess(mode, size)(inputs))
+    return keras.Model(inputs, outputs, name=model.name)
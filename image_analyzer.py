@@ -7,6 +7,10 @@ import numpy as np
 from PIL import Image
 
 
+# Điểm tối thiểu (0-100) để ảnh được xem là X-quang nha khoa
+XRAY_SCORE_THRESHOLD = 60
+
+
 def analyze_image_features(img_path):
     """
     Phân tích đặc trưng ảnh X-quang để ước lượng mức độ nghiêm trọng
@@ -27,7 +31,16 @@ def analyze_image_features(img_path):
     if img is None:
         raise ValueError(f"Không thể đọc ảnh: {img_path}")
     
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    return analyze_image_features_array(img)
+
+
+def analyze_image_features_array(img, gray=None):
+    """
+    Giống analyze_image_features nhưng nhận ảnh BGR đã decode (np.ndarray)
+    (gray: ảnh xám đã chuyển sẵn, tùy chọn)
+    """
+    if gray is None:
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
     
     # 1. Phân tích vùng tối (dark regions - có thể là vùng sâu răng)
     dark_area_ratio = analyze_dark_regions(gray)
@@ -127,7 +140,7 @@ def analyze_histogram(gray_img):
     variance = np.var(hist)
     
     # Normalize (variance thường rất nhỏ)
-    return min(variance * 10000, 1.0)
+    return min(float(variance) * 10000, 1.0)
 
 
 def calculate_severity_score(dark_ratio, contrast, edge_intensity, hist_var):
@@ -159,7 +172,7 @@ def calculate_severity_score(dark_ratio, contrast, edge_intensity, hist_var):
         hist_var * weights['hist_var']
     ) * 100
     
-    return min(score, 100.0)
+    return np.minimum(score, 100.0)
 
 
 def classify_severity_level(severity_score, disease_class):
@@ -220,50 +233,70 @@ def is_dental_xray(img_path):
         if img is None:
             return False, 0, "Không thể đọc file ảnh"
         
-        # Chuyển sang grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        
-        # 1. Kiểm tra màu sắc - X-quang thường là grayscale hoặc blue-tinted
-        color_score = check_color_distribution(img)
-        
-        # 2. Kiểm tra độ tương phản - X-quang có contrast cao
-        contrast_score = check_contrast_level(gray)
-        
-        # 3. Kiểm tra phân bố histogram - X-quang có bimodal distribution
-        histogram_score = check_histogram_pattern(gray)
-        
-        # 4. Kiểm tra tỷ lệ vùng sáng/tối
-        brightness_score = check_brightness_distribution(gray)
-        
-        # Tính tổng điểm
-        total_score = (
-            color_score * 0.3 +
-            contrast_score * 0.25 +
-            histogram_score * 0.25 +
-            brightness_score * 0.2
-        )
-        
-        # Threshold: >= 60 là hợp lệ
-        is_valid = total_score >= 60
-        
-        # Xác định lý do nếu không hợp lệ
-        reason = ""
-        if not is_valid:
-            if color_score < 50:
-                reason = "Ảnh có quá nhiều màu sắc, không giống ảnh X-quang (X-quang thường là ảnh xám)"
-            elif contrast_score < 50:
-                reason = "Độ tương phản thấp, không đặc trưng của ảnh X-quang"
-            elif histogram_score < 50:
-                reason = "Phân bố sáng tối không giống ảnh X-quang nha khoa"
-            else:
-                reason = "Đặc điểm ảnh không phù hợp với ảnh X-quang nha khoa"
-        
-        return is_valid, total_score, reason
+        return is_dental_xray_array(img)
     
     except Exception as e:
         return False, 0, f"Lỗi khi phân tích ảnh: {str(e)}"
 
 
+def is_dental_xray_array(img, gray=None):
+    """
+    Giống is_dental_xray nhưng nhận ảnh BGR đã decode (np.ndarray)
+    (gray: ảnh xám đã chuyển sẵn, tùy chọn)
+    """
+    # Chuyển sang grayscale
+    if gray is None:
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    
+    # 1. Kiểm tra màu sắc - X-quang thường là grayscale hoặc blue-tinted
+    color_score = check_color_distribution(img)
+    
+    # 2. Kiểm tra độ tương phản - X-quang có contrast cao
+    contrast_score = check_contrast_level(gray)
+    
+    # 3. Kiểm tra phân bố histogram - X-quang có bimodal distribution
+    histogram_score = check_histogram_pattern(gray)
+    
+    # 4. Kiểm tra tỷ lệ vùng sáng/tối
+    brightness_score = check_brightness_distribution(gray)
+    
+    # Tính tổng điểm
+    total_score = combine_xray_scores(color_score, contrast_score,
+                                      histogram_score, brightness_score)
+    
+    # Threshold: >= 60 là hợp lệ
+    is_valid = total_score >= XRAY_SCORE_THRESHOLD
+    
+    # Xác định lý do nếu không hợp lệ
+    reason = ""
+    if not is_valid:
+        reason = xray_invalid_reason(color_score, contrast_score, histogram_score)
+    
+    return is_valid, total_score, reason
+
+
+def combine_xray_scores(color_score, contrast_score, histogram_score, brightness_score):
+    """Tổng hợp điểm kiểm tra X-quang (0-100)"""
+    return (
+        color_score * 0.3 +
+        contrast_score * 0.25 +
+        histogram_score * 0.25 +
+        brightness_score * 0.2
+    )
+
+
+def xray_invalid_reason(color_score, contrast_score, histogram_score):
+    """Lý do ảnh không được xem là X-quang nha khoa"""
+    if color_score < 50:
+        return "Ảnh có quá nhiều màu sắc, không giống ảnh X-quang (X-quang thường là ảnh xám)"
+    elif contrast_score < 50:
+        return "Độ tương phản thấp, không đặc trưng của ảnh X-quang"
+    elif histogram_score < 50:
+        return "Phân bố sáng tối không giống ảnh X-quang nha khoa"
+    else:
+        return "Đặc điểm ảnh không phù hợp với ảnh X-quang nha khoa"
+
+
 def check_color_distribution(img):
     """
     Kiểm tra phân bố màu sắc
@@ -283,20 +316,26 @@ def check_color_distribution(img):
     
     avg_std = (std_bg + std_br + std_gr) / 3
     
+    return color_score_from_std(avg_std)
+
+
+def color_score_from_std(avg_std):
+    """
+    Quy đổi độ lệch chuẩn trung bình giữa các kênh màu thành điểm (scalar hoặc np.ndarray)
+    """
     # X-quang grayscale: avg_std thấp (~0-20)
     # X-quang blue-tinted: avg_std trung bình (~20-50)
     # Ảnh màu thông thường: avg_std cao (>50)
     
-    if avg_std < 15:
-        return 100  # Perfect grayscale
-    elif avg_std < 30:
-        return 80   # Grayscale or slight blue tint
-    elif avg_std < 50:
-        return 60   # Acceptable blue tint
-    elif avg_std < 80:
-        return 30   # Too colorful
-    else:
-        return 0    # Definitely not X-ray
+    score = np.select(
+        [avg_std < 15,   # Perfect grayscale
+         avg_std < 30,   # Grayscale or slight blue tint
+         avg_std < 50,   # Acceptable blue tint
+         avg_std < 80],  # Too colorful
+        [100, 80, 60, 30],
+        default=0        # Definitely not X-ray
+    )
+    return score if np.ndim(avg_std) else int(score)
 
 
 def check_contrast_level(gray_img):
@@ -310,17 +349,24 @@ def check_contrast_level(gray_img):
     # Tính standard deviation - đo độ tương phản
     std_dev = np.std(gray_img)
     
+    return contrast_score_from_std(std_dev)
+
+
+def contrast_score_from_std(std_dev):
+    """
+    Quy đổi độ lệch chuẩn intensity thành điểm tương phản (scalar hoặc np.ndarray)
+    """
     # X-quang nha khoa thường có std_dev cao (40-70)
     # Ảnh thông thường có std_dev thấp hơn hoặc rất cao
     
-    if 40 <= std_dev <= 70:
-        return 100
-    elif 30 <= std_dev <= 80:
-        return 70
-    elif 20 <= std_dev <= 90:
-        return 40
-    else:
-        return 20
+    score = np.select(
+        [(std_dev >= 40) & (std_dev <= 70),
+         (std_dev >= 30) & (std_dev <= 80),
+         (std_dev >= 20) & (std_dev <= 90)],
+        [100, 70, 40],
+        default=20
+    )
+    return score if np.ndim(std_dev) else int(score)
 
 
 def check_histogram_pattern(gray_img):
@@ -341,6 +387,13 @@ def check_histogram_pattern(gray_img):
     except:
         hist_smooth = hist
     
+    return histogram_score_from_smooth(hist, hist_smooth)
+
+
+def histogram_score_from_smooth(hist, hist_smooth):
+    """
+    Tính điểm histogram từ histogram gốc và histogram đã làm mượt
+    """
     # Tìm peaks
     from scipy.signal import find_peaks
     try:
@@ -379,22 +432,273 @@ def check_brightness_distribution(gray_img):
     dark_ratio = dark_pixels / total_pixels
     bright_ratio = bright_pixels / total_pixels
     
+    return brightness_score_from_ratios(dark_ratio, bright_ratio)
+
+
+def brightness_score_from_ratios(dark_ratio, bright_ratio):
+    """
+    Quy đổi tỷ lệ pixel tối/sáng thành điểm (scalar hoặc np.ndarray)
+    """
     # X-quang nha khoa: 20-50% dark, 10-40% bright
-    score = 0
+    dark_score = np.select(
+        [(dark_ratio >= 0.2) & (dark_ratio <= 0.5),
+         (dark_ratio >= 0.1) & (dark_ratio <= 0.6)],
+        [50, 30],
+        default=0
+    )
+    bright_score = np.select(
+        [(bright_ratio >= 0.1) & (bright_ratio <= 0.4),
+         (bright_ratio >= 0.05) & (bright_ratio <= 0.5)],
+        [50, 30],
+        default=0
+    )
+    score = dark_score + bright_score
+    return score if np.ndim(dark_ratio) else int(score)
+
+
+# ==================== Batch (vectorized) ====================
+
+def prepare_analysis_batch(images, size=None):
+    """
+    Xếp các ảnh BGR cùng kích thước thành một mảng
     
-    if 0.2 <= dark_ratio <= 0.5:
-        score += 50
-    elif 0.1 <= dark_ratio <= 0.6:
-        score += 30
+    Args:
+        images: list ảnh BGR đã decode (np.ndarray uint8, (H, W, 3) hoặc (H, W))
+        size: (width, height) để resize trước khi phân tích (None = giữ nguyên, các ảnh phải cùng kích thước).
+              Lưu ý: edge_intensity phụ thuộc độ phân giải, resize sẽ thay đổi kết quả
+    
+    Returns:
+        tuple: (bgr, gray)
+            - bgr: np.ndarray uint8 (N, height, width, 3)
+            - gray: np.ndarray uint8 (N, height, width)
+    """
+    if any(img is None for img in images):
+        raise ValueError("Có ảnh không hợp lệ (None) trong batch")
+    if size is None:
+        shapes = {img.shape[:2] for img in images}
+        if len(shapes) != 1:
+            raise ValueError(f"Các ảnh phải cùng kích thước khi size=None (có {sorted(shapes)})")
+        height, width = shapes.pop()
+    else:
+        width, height = size
+    
+    bgr = np.empty((len(images), height, width, 3), dtype=np.uint8)
+    for i, img in enumerate(images):
+        if img.ndim == 2:
+            img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+        if img.shape[:2] != (height, width):
+            img = cv2.resize(img, (width, height), interpolation=cv2.INTER_AREA)
+        bgr[i] = img
     
-    if 0.1 <= bright_ratio <= 0.4:
-        score += 50
-    elif 0.05 <= bright_ratio <= 0.5:
-        score += 30
+    # Chuyển grayscale cả batch bằng một lần gọi (xếp chồng thành một ảnh cao)
+    gray = cv2.cvtColor(bgr.reshape(-1, width, 3), cv2.COLOR_BGR2GRAY)
+    gray = gray.reshape(len(images), height, width)
     
-    return score
+    return bgr, gray
+
+
+def stack_histograms(planes, bins):
+    """
+    Histogram số nguyên của từng mặt phẳng ảnh, xếp thành ma trận (N, bins)
+    
+    cv2.calcHist trên từng mặt phẳng nhanh hơn np.bincount trên cả batch (đã dời offset),
+    vì bincount phải chuyển mọi pixel sang intp; phần toán phía sau chạy vector hóa trên ma trận này.
+    
+    Args:
+        planes: các mặt phẳng uint8/uint16 (H, W), giá trị trong [0, bins)
+        bins: Số bins
+    
+    Returns:
+        np.ndarray float64 (N, bins)
+    """
+    return np.stack([cv2.calcHist([plane], [0], None, [bins], [0, bins]).ravel()
+                     for plane in planes]).astype(np.float64)
+
+
+def channel_diff_histograms(bgr):
+    """
+    Histogram của hiệu các cặp kênh (B-G, B-R, G-R) cho từng ảnh, giá trị dời +255 về [0, 511)
+    
+    Returns:
+        list[np.ndarray]: 3 ma trận (N, 511)
+    """
+    diffs = ([], [], [])
+    for img in bgr:
+        b, g, r = cv2.split(img.astype(np.uint16))
+        for out, (x, y) in zip(diffs, ((b, g), (b, r), (g, r))):
+            out.append(x + np.uint16(255) - y)
+    return [stack_histograms(planes, 511) for planes in diffs]
+
+
+def std_from_histogram(hist, levels):
+    """
+    Độ lệch chuẩn (như np.std) của từng hàng tính từ histogram
+    
+    Args:
+        hist: np.ndarray (N, bins) số pixel mỗi giá trị
+        levels: np.ndarray (bins,) giá trị tương ứng mỗi bin
+    """
+    total = hist.sum(axis=1)
+    mean = hist @ levels / total
+    return np.sqrt((hist * (levels[None, :] - mean[:, None]) ** 2).sum(axis=1) / total)
+
+
+GRAY_LEVELS = np.arange(256, dtype=np.float64)
+DIFF_LEVELS = np.arange(-255, 256, dtype=np.float64)
+
+
+def analyze_image_features_batch(images, size=None):
+    """
+    Phiên bản batch của analyze_image_features
+    
+    Vùng tối, độ tương phản và độ phân tán được tính vector hóa từ ma trận histogram của cả batch;
+    Canny vẫn chạy từng ảnh. Với các ảnh cùng kích thước (size=None), kết quả giống
+    analyze_image_features_array của từng ảnh (sai số làm tròn float).
+    
+    Args:
+        images: list ảnh BGR đã decode (np.ndarray)
+        size: (width, height) để resize trước (None = các ảnh phải cùng kích thước)
+    
+    Returns:
+        list[dict]: Cùng định dạng với analyze_image_features
+    """
+    if len(images) == 0:
+        return []
+    
+    _, gray = prepare_analysis_batch(images, size)
+    n = gray.shape[0]
+    total_pixels = gray.shape[1] * gray.shape[2]
+    
+    # Histogram dùng chung cho vùng tối, độ tương phản và độ phân tán
+    hist = stack_histograms(gray, 256)
+    
+    # 1. Vùng tối (giống cv2.threshold(80, THRESH_BINARY_INV): pixel <= 80)
+    dark_area_ratio = np.minimum(hist[:, :81].sum(axis=1) / total_pixels * 2, 1.0)
+    
+    # 2. Độ tương phản
+    contrast_level = np.minimum(std_from_histogram(hist, GRAY_LEVELS) / 70.0, 1.0)
+    
+    # 3. Cạnh - Canny không vector hóa được, chạy từng ảnh
+    edge_ratio = np.array([np.count_nonzero(cv2.Canny(g, 50, 150)) for g in gray]) / total_pixels
+    edge_intensity = np.minimum(edge_ratio * 10, 1.0)
+    
+    # 4. Histogram (giống cv2.calcHist float32 rồi chuẩn hóa)
+    hist_norm = hist.astype(np.float32)
+    hist_norm /= hist_norm.sum(axis=1, keepdims=True)
+    hist_variance = np.minimum(hist_norm.var(axis=1).astype(np.float64) * 10000, 1.0)
+    
+    severity_score = calculate_severity_score(
+        dark_area_ratio,
+        contrast_level,
+        edge_intensity,
+        hist_variance
+    )
+    
+    return [
+        {
+            'severity_score': float(severity_score[i]),
+            'dark_area_ratio': float(dark_area_ratio[i]),
+            'contrast_level': float(contrast_level[i]),
+            'edge_intensity': float(edge_intensity[i]),
+            'hist_variance': float(hist_variance[i])
+        }
+        for i in range(n)
+    ]
+
+
+def is_dental_xray_batch(images, size=None):
+    """
+    Phiên bản batch của is_dental_xray
+    
+    Màu sắc, độ tương phản và tỷ lệ sáng/tối được tính vector hóa từ ma trận histogram của cả batch;
+    chỉ tìm peaks (trên 256 bins) chạy từng ảnh. Với các ảnh cùng kích thước (size=None),
+    kết quả giống is_dental_xray_array của từng ảnh.
+    
+    Args:
+        images: list ảnh BGR đã decode (np.ndarray)
+        size: (width, height) để resize trước (None = các ảnh phải cùng kích thước)
+    
+    Returns:
+        list[tuple]: (is_valid, confidence, reason) cho từng ảnh
+    """
+    if len(images) == 0:
+        return []
+    
+    bgr, gray = prepare_analysis_batch(images, size)
+    n = gray.shape[0]
+    total_pixels = gray.shape[1] * gray.shape[2]
+    
+    # 1. Màu sắc - độ lệch chuẩn của hiệu giữa các kênh (int16, trong [-255, 255]) từ histogram
+    avg_std = sum(std_from_histogram(diff_hist, DIFF_LEVELS)
+                  for diff_hist in channel_diff_histograms(bgr)) / 3
+    color_score = color_score_from_std(avg_std)
+    
+    # 2. Độ tương phản
+    hist = stack_histograms(gray, 256)
+    contrast_score = contrast_score_from_std(std_from_histogram(hist, GRAY_LEVELS))
+    
+    # 3. Histogram - làm mượt cả batch một lần, tìm peaks từng ảnh (256 bins)
+    from scipy.ndimage import gaussian_filter1d
+    hist = hist.astype(np.float32)
+    try:
+        hist_smooth = gaussian_filter1d(hist, sigma=5, axis=1)
+    except:
+        hist_smooth = hist
+    histogram_score = np.array([
+        histogram_score_from_smooth(hist[i], hist_smooth[i]) for i in range(n)
+    ])
+    
+    # 4. Vùng sáng/tối (đếm từ histogram: < 80 và > 150)
+    dark_ratio = hist[:, :80].sum(axis=1) / total_pixels
+    bright_ratio = hist[:, 151:].sum(axis=1) / total_pixels
+    brightness_score = brightness_score_from_ratios(dark_ratio, bright_ratio)
+    
+    total_score = combine_xray_scores(color_score, contrast_score,
+                                      histogram_score, brightness_score)
+    is_valid = total_score >= XRAY_SCORE_THRESHOLD
+    
+    return [
+        (bool(is_valid[i]),
+         float(total_score[i]),
+         "" if is_valid[i] else xray_invalid_reason(color_score[i], contrast_score[i],
+                                                      histogram_score[i]))
+        for i in range(n)
+    ]
+
+
+def check_batch_consistency(images):
+    """
+    Kiểm tra bản batch cho cùng kết quả với bản từng ảnh (các ảnh cùng kích thước)
+    
+    Returns:
+        list[str]: Các sai khác (rỗng = khớp)
+    """
+    mismatches = []
+    features = analyze_image_features_batch(images)
+    checks = is_dental_xray_batch(images)
+    for i, img in enumerate(images):
+        single = analyze_image_features_array(img)
+        for key, value in single.items():
+            if not np.isclose(features[i][key], value, rtol=1e-6, atol=1e-9):
+                mismatches.append(f"ảnh {i} {key}: batch {features[i][key]} != {value}")
+        valid, score, reason = is_dental_xray_array(img)
+        if checks[i] != (valid, score, reason):
+            mismatches.append(f"ảnh {i} is_dental_xray: batch {checks[i]} != {(valid, score, reason)}")
+    return mismatches
 
 
 if __name__ == '__main__':
-    # Test module
-    print("Module phân tích ảnh X-quang đã sẵn sàng!")
+    # Test module: bản batch phải khớp bản từng ảnh trên các ảnh cùng kích thước
+    rng = np.random.default_rng(0)
+    samples = []
+    for _ in range(8):
+        coarse = rng.integers(0, 255, (16, 24), dtype=np.uint8)
+        img = cv2.resize(coarse, (768, 512), interpolation=cv2.INTER_CUBIC) // 2
+        img = img + rng.integers(0, 40, img.shape, dtype=np.uint8)
+        samples.append(cv2.cvtColor(img, cv2.COLOR_GRAY2BGR))
+    samples.append(rng.integers(0, 255, (512, 768, 3), dtype=np.uint8))
+    
+    mismatches = check_batch_consistency(samples)
+    if mismatches:
+        raise SystemExit("\n".join(mismatches))
+    print("Module phân tích ảnh X-quang đã sẵn sàng! (batch khớp với từng ảnh)")
@@ -0,0 +1,46 @@
+"""
+Metrics đơn giản trong process (counters, gauges, sự kiện gần đây)
+Xuất qua endpoint /metrics dạng JSON
+"""
+import threading
+import time
+from collections import defaultdict, deque
+
+
+MAX_EVENTS = 200
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_gauges = {}
+_events = deque(maxlen=MAX_EVENTS)
+
+
+def inc(name, value=1):
+    """Tăng counter"""
+    with _lock:
+        _counters[name] += value
+
+
+def set_gauge(name, value):
+    """Đặt giá trị gauge"""
+    with _lock:
+        _gauges[name] = value
+
+
+def record_event(kind, **fields):
+    """Ghi lại một sự kiện (vd: load/swap/evict model) và tăng counter events.<kind>"""
+    event = {'time': time.time(), 'kind': kind}
+    event.update(fields)
+    with _lock:
+        _events.append(event)
+        _counters[f'events.{kind}'] += 1
+
+
+def snapshot():
+    """Toàn bộ metrics hiện tại"""
+    with _lock:
+        return {
+            'counters': dict(_counters),
+            'gauges': dict(_gauges),
+            'events': list(_events)
+        }
@@ -0,0 +1,359 @@
+"""
+Model registry có phiên bản, hỗ trợ hot-swap không downtime
+- Mỗi nhóm model (vd: CBAM ensemble, ResNet50) được đăng ký với danh sách file và hàm load
+- Thread nền theo dõi thư mục models, khi file thay đổi thì load + warm up phiên bản mới
+  rồi thay thế nguyên tử; request đang chạy vẫn dùng phiên bản cũ cho đến khi xong
+- Giới hạn bộ nhớ: model được load khi cần, model ít dùng/không dùng lâu bị giải phóng
+  khi vượt ngân sách bộ nhớ hoặc quá thời gian idle
+"""
+import ctypes
+import ctypes.util
+import gc
+import hashlib
+import os
+import threading
+import time
+import traceback
+
+import metrics
+
+
+VERSION_HASH_LENGTH = 8
+
+
+def file_signature(paths):
+    """Chữ ký rẻ (mtime, size) của các file để phát hiện thay đổi"""
+    signature = []
+    for label, path in paths:
+        try:
+            stat = os.stat(path)
+            signature.append((label, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            signature.append((label, None, None))
+    return tuple(signature)
+
+
+def files_size(paths):
+    """Tổng kích thước các file (ước lượng bộ nhớ mặc định của một nhóm model)"""
+    return sum(os.path.getsize(path) for _, path in paths if os.path.exists(path))
+
+
+def release_memory():
+    """
+    Thu hồi bộ nhớ sau khi bỏ model: chạy GC và trả heap rảnh về hệ điều hành (glibc)
+    """
+    gc.collect()
+    libc_name = ctypes.util.find_library('c')
+    if libc_name:
+        try:
+            ctypes.CDLL(libc_name).malloc_trim(0)
+        except (OSError, AttributeError):
+            pass
+
+
+def file_version(label, path):
+    """Phiên bản của một file model: '<label>@<sha256 rút gọn>'"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return f"{label}@{digest.hexdigest()[:VERSION_HASH_LENGTH]}"
+
+
+class ModelSet:
+    """
+    Một phiên bản đã load của một nhóm model (không thay đổi sau khi tạo)
+
+    Attributes:
+        name: Tên nhóm (vd: 'cbam_ensemble')
+        models: tuple các keras.Model
+        versions: tuple phiên bản tương ứng từng model (vd: 'v1@1a2b3c4d')
+        loaded_at: Thời điểm load
+        last_used: Lần cuối được lấy ra dùng
+        size_bytes: Ước lượng bộ nhớ
+        cache: dict cho dữ liệu dẫn xuất gắn với phiên bản này (vd: model đã gộp)
+    """
+
+    def __init__(self, name, models, versions, size_bytes=0):
+        self.name = name
+        self.models = tuple(models)
+        self.versions = tuple(versions)
+        self.loaded_at = time.time()
+        self.last_used = self.loaded_at
+        self.size_bytes = size_bytes
+        self.cache = {}
+        self._cache_lock = threading.RLock()
+
+    def cached(self, key, factory):
+        """Lấy (hoặc tạo một lần) dữ liệu dẫn xuất gắn với phiên bản này"""
+        with self._cache_lock:
+            if key not in self.cache:
+                self.cache[key] = factory(self)
+            return self.cache[key]
+
+    def clear_cache(self):
+        """Bỏ toàn bộ dữ liệu dẫn xuất (được tạo lại khi cần)"""
+        with self._cache_lock:
+            self.cache.clear()
+
+    @property
+    def version(self):
+        return ','.join(self.versions)
+
+
+class ModelSpec:
+    """Thông tin đăng ký của một nhóm model"""
+
+    def __init__(self, name, paths_fn, load_fn, warmup_fn=None, size_fn=None, pinned=False):
+        self.name = name
+        self.paths_fn = paths_fn
+        self.load_fn = load_fn
+        self.warmup_fn = warmup_fn
+        self.size_fn = size_fn
+        self.pinned = pinned
+        self.signature = None
+        # Chữ ký mới thấy ở lần kiểm tra trước (chờ file ổn định trước khi load)
+        self.pending_signature = None
+
+
+class ModelRegistry:
+    """
+    Registry các nhóm model
+
+    Args (register):
+        paths_fn: () -> list[(label, path)] các file hiện có
+        load_fn: (list[(label, path)]) -> (models, labels) - labels là các label load thành công
+        warmup_fn: (ModelSet) -> None, chạy trước khi đưa phiên bản mới vào sử dụng
+        size_fn: (models) -> bytes, ước lượng bộ nhớ (mặc định: tổng kích thước file)
+        pinned: Không bao giờ bị giải phóng (vd: ensemble dùng cho mọi request)
+
+    Args (constructor):
+        memory_budget: Ngân sách bộ nhớ cho tất cả model (bytes, 0 = không giới hạn)
+        idle_timeout: Giải phóng model không pinned không được dùng quá số giây này (0 = tắt)
+    """
+
+    def __init__(self, memory_budget=0, idle_timeout=0):
+        self.memory_budget = memory_budget
+        self.idle_timeout = idle_timeout
+        self._specs = {}
+        self._active = {}
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self._watcher = None
+        self._stop = threading.Event()
+
+    def register(self, name, paths_fn, load_fn, warmup_fn=None, size_fn=None, pinned=False):
+        self._specs[name] = ModelSpec(name, paths_fn, load_fn, warmup_fn, size_fn, pinned)
+        self._load_locks[name] = threading.Lock()
+
+    def get(self, name):
+        """
+        Phiên bản đang active của nhóm model (load đồng bộ nếu chưa có)
+
+        Request nên gọi get() một lần và dùng ModelSet trả về cho đến hết request.
+        """
+        model_set = self._active.get(name)
+        if model_set is None:
+            with self._load_locks[name]:
+                model_set = self._active.get(name)
+                if model_set is None:
+                    spec = self._specs[name]
+                    # Giải phóng trước để tránh vượt ngân sách lúc đang load
+                    self._make_room(files_size(spec.paths_fn()), exclude=name)
+                    model_set = self._load(spec)
+                    self._swap(model_set)
+                    self._make_room(0, exclude=name)
+
+        model_set.last_used = time.time()
+        return model_set
+
+    def peek(self, name):
+        """Phiên bản đang active (None nếu chưa load, không tự load)"""
+        return self._active.get(name)
+
+    def loaded(self):
+        """Các ModelSet đang active"""
+        return list(self._active.values())
+
+    def clear_caches(self, reason='manual'):
+        """Bỏ dữ liệu dẫn xuất (predict functions, model đã gộp, ...) của mọi nhóm đang load"""
+        for model_set in self.loaded():
+            model_set.clear_cache()
+        release_memory()
+        metrics.record_event('model_cache_clear', reason=reason)
+
+    def active_versions(self):
+        """{tên nhóm: chuỗi phiên bản} của các nhóm đã load"""
+        return {name: model_set.version for name, model_set in list(self._active.items())}
+
+    def unload(self, name, reason='manual'):
+        """Bỏ phiên bản active (request đang giữ ModelSet vẫn dùng được đến khi xong)"""
+        with self._lock:
+            model_set = self._active.pop(name, None)
+        if model_set is None:
+            return False
+
+        idle = round(time.time() - model_set.last_used, 1)
+        size_bytes = model_set.size_bytes
+        del model_set
+        release_memory()
+        metrics.record_event('model_evict', name=name, reason=reason,
+                             size_bytes=size_bytes, idle_seconds=idle)
+        metrics.set_gauge(f'model_version.{name}', None)
+        self._update_memory_gauges()
+        print(f"♻ Evicted {name} ({reason})")
+        return True
+
+    def total_bytes(self):
+        """Tổng bộ nhớ ước lượng của các model đang active"""
+        return sum(model_set.size_bytes for model_set in list(self._active.values()))
+
+    def _update_memory_gauges(self):
+        metrics.set_gauge('model_pool.bytes', self.total_bytes())
+        metrics.set_gauge('model_pool.budget_bytes', self.memory_budget)
+        metrics.set_gauge('model_pool.loaded', sorted(self._active))
+
+    def _make_room(self, needed_bytes, exclude=None):
+        """Giải phóng model ít dùng nhất (không pinned) cho đến khi đủ ngân sách"""
+        if not self.memory_budget:
+            return
+
+        while self.total_bytes() + needed_bytes > self.memory_budget:
+            candidates = [
+                model_set for name, model_set in list(self._active.items())
+                if name != exclude and not self._specs[name].pinned
+            ]
+            if not candidates:
+                return
+            lru = min(candidates, key=lambda model_set: model_set.last_used)
+            self.unload(lru.name, reason='memory_budget')
+
+    def evict_idle(self):
+        """Giải phóng các model không pinned đã idle quá idle_timeout"""
+        if not self.idle_timeout:
+            return
+
+        now = time.time()
+        for name, model_set in list(self._active.items()):
+            if not self._specs[name].pinned and now - model_set.last_used > self.idle_timeout:
+                self.unload(name, reason='idle')
+
+    def _load(self, spec, require_all=False):
+        """
+        Load một phiên bản mới
+
+        Args:
+            require_all: Lỗi nếu có file tồn tại nhưng không load được (dùng khi hot-swap)
+        """
+        paths = spec.paths_fn()
+        signature = file_signature(paths)
+        existing = [(label, path) for label, path in paths if os.path.exists(path)]
+
+        start = time.time()
+        models, labels = spec.load_fn(existing)
+        path_by_label = dict(existing)
+        failed = [label for label in path_by_label if label not in labels]
+        if require_all and failed:
+            raise RuntimeError(f"Không load được {', '.join(failed)} của {spec.name}")
+
+        versions = [file_version(label, path_by_label[label]) for label in labels]
+        if spec.size_fn is not None:
+            size_bytes = spec.size_fn(models)
+        else:
+            size_bytes = files_size([(label, path_by_label[label]) for label in labels])
+        model_set = ModelSet(spec.name, models, versions, size_bytes)
+
+        if spec.warmup_fn is not None:
+            spec.warmup_fn(model_set)
+
+        spec.signature = signature
+        metrics.record_event('model_load', name=spec.name, version=model_set.version,
+                             seconds=round(time.time() - start, 3), size_bytes=size_bytes)
+        return model_set
+
+    def _swap(self, model_set):
+        with self._lock:
+            old = self._active.get(model_set.name)
+            if old is not None:
+                model_set.last_used = old.last_used
+            self._active[model_set.name] = model_set
+        metrics.set_gauge(f'model_version.{model_set.name}', model_set.version)
+        self._update_memory_gauges()
+        if old is not None:
+            metrics.record_event('model_swap', name=model_set.name,
+                                 old_version=old.version, new_version=model_set.version)
+            del old
+            release_memory()
+
+    def reload(self, name):
+        """
+        Load lại nhóm model nếu file thay đổi, warm up rồi hot-swap
+
+        Chỉ load khi chữ ký file giữ nguyên qua 2 lần kiểm tra liên tiếp (file có thể đang được copy).
+        Phiên bản cũ được giữ nếu có file không load được hoặc phiên bản mới có ít model hơn.
+
+        Returns:
+            bool: True nếu đã swap phiên bản mới
+        """
+        spec = self._specs[name]
+        if self._active.get(name) is None:
+            # Chưa từng dùng -> sẽ load khi cần
+            return False
+        signature = file_signature(spec.paths_fn())
+        if signature == spec.signature:
+            spec.pending_signature = None
+            return False
+        if signature != spec.pending_signature:
+            spec.pending_signature = signature
+            return False
+
+        with self._load_locks[name]:
+            if file_signature(spec.paths_fn()) == spec.signature:
+                return False
+            active = self._active[name]
+            try:
+                model_set = self._load(spec, require_all=True)
+                if len(model_set.models) < len(active.models):
+                    raise RuntimeError(f"{name} mới chỉ có {len(model_set.models)} model "
+                                       f"(đang dùng {len(active.models)})")
+            except Exception as e:
+                # Giữ phiên bản cũ nếu phiên bản mới lỗi (thử lại khi file thay đổi tiếp)
+                spec.signature = signature
+                metrics.record_event('model_load_failed', name=name, error=str(e))
+                traceback.print_exc()
+                return False
+
+            if model_set.version == active.version:
+                return False
+            self._swap(model_set)
+            print(f"✓ Hot-swapped {name}: {model_set.version}")
+            return True
+
+    def check_for_updates(self):
+        """Kiểm tra tất cả nhóm model đã load"""
+        for name in list(self._specs):
+            self.reload(name)
+
+    def start_watcher(self, interval, watch_files=True):
+        """
+        Chạy thread nền mỗi `interval` giây: kiểm tra thay đổi file models (nếu watch_files)
+        và giải phóng model idle
+        """
+        if self._watcher is not None or interval <= 0:
+            return
+
+        def watch():
+            while not self._stop.wait(interval):
+                try:
+                    if watch_files:
+                        self.check_for_updates()
+                    self.evict_idle()
+                except Exception:
+                    traceback.print_exc()
+
+        self._watcher = threading.Thread(target=watch, name='model-registry-watcher', daemon=True)
+        self._watcher.start()
+
+    def stop_watcher(self):
+        self._stop.set()
+        self._watcher = None
@@ -0,0 +1,113 @@
+"""
+Perceptual hash (pHash) cho ảnh X-quang và chỉ mục tìm ảnh gần trùng (BK-tree theo khoảng cách Hamming)
+Ảnh được xuất lại, resize hoặc nén lại bởi phần mềm khác vẫn có pHash gần nhau,
+trong khi SHA-256 của file thì khác hoàn toàn
+"""
+import threading
+
+import cv2
+import numpy as np
+
+
+HASH_SIZE = 8
+DCT_SIZE = 32
+
+
+def compute_phash(gray):
+    """
+    pHash 64 bit của ảnh xám: DCT của ảnh thu nhỏ 32x32, so sánh 8x8 hệ số tần số thấp với median
+
+    Args:
+        gray: Ảnh xám uint8 (H, W)
+
+    Returns:
+        str: 16 ký tự hex
+    """
+    small = cv2.resize(gray, (DCT_SIZE, DCT_SIZE), interpolation=cv2.INTER_AREA)
+    low = cv2.dct(small.astype(np.float32))[:HASH_SIZE, :HASH_SIZE].flatten()
+    # Bỏ hệ số DC (độ sáng trung bình) khi tính median
+    bits = low > np.median(low[1:])
+    value = int.from_bytes(np.packbits(bits).tobytes(), 'big')
+    return f'{value:016x}'
+
+
+def hamming_distance(a, b):
+    """Số bit khác nhau giữa 2 hash (int)"""
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """
+    BK-tree theo khoảng cách Hamming: tìm các hash trong bán kính d mà không duyệt toàn bộ
+    Mỗi node: [hash, list giá trị, dict {khoảng cách: node con}]
+    """
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, hash_value, value):
+        self.size += 1
+        if self.root is None:
+            self.root = [hash_value, [value], {}]
+            return
+
+        node = self.root
+        while True:
+            distance = hamming_distance(hash_value, node[0])
+            if distance == 0:
+                node[1].append(value)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [hash_value, [value], {}]
+                return
+            node = child
+
+    def search(self, hash_value, max_distance):
+        """
+        Returns:
+            list[(distance, value)] sắp xếp theo khoảng cách tăng dần
+        """
+        matches = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(hash_value, node[0])
+            if distance <= max_distance:
+                matches.extend((distance, value) for value in node[1])
+            # Bất đẳng thức tam giác: chỉ các nhánh trong [d - r, d + r] có thể chứa kết quả
+            for child_distance, child in node[2].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        return sorted(matches, key=lambda match: match[0])
+
+
+class NearDuplicateIndex:
+    """
+    Chỉ mục pHash -> id kết quả trong ResultsStore (mỗi worker một bản, nạp dần các bản ghi mới)
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.tree = BKTree()
+        self.last_id = 0
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """Nạp các bản ghi mới (kể cả do worker khác lưu) vào cây"""
+        for record_id, phash in self.store.perceptual_hashes(after_id=self.last_id):
+            self.tree.add(int(phash, 16), record_id)
+            self.last_id = max(self.last_id, record_id)
+
+    def search(self, phash, max_distance):
+        """
+        Returns:
+            list[(distance, record_id)] sắp xếp theo khoảng cách tăng dần
+        """
+        with self._lock:
+            self.refresh()
+            return self.tree.search(int(phash, 16), max_distance)
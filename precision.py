@@ -0,0 +1,72 @@
+"""
+Inference với độ chính xác bfloat16 trên CPU (AVX-512 BF16 / AMX)
+- Weights và activations chuyển sang bfloat16
+- Softmax giữ float32; BatchNormalization giữ weights float32 (mixed_bfloat16)
+- Trung bình ensemble được tính bằng NumPy float trong app
+"""
+import os
+os.environ['KERAS_BACKEND'] = 'tensorflow'
+
+import keras
+
+
+PRECISIONS = ('float32', 'bfloat16')
+BF16_CPU_FLAGS = {'avx512_bf16', 'amx_bf16'}
+
+# Layer chuẩn hóa: giữ weights float32, tính toán nội bộ float32 (Keras tự upcast)
+NORMALIZATION_LAYERS = (keras.layers.BatchNormalization, keras.layers.LayerNormalization)
+
+
+def cpu_flags():
+    """Các cờ CPU (Linux /proc/cpuinfo), rỗng nếu không đọc được"""
+    try:
+        with open('/proc/cpuinfo', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith('flags'):
+                    return set(line.split(':', 1)[1].split())
+    except OSError:
+        pass
+    return set()
+
+
+def cpu_supports_bfloat16():
+    """CPU có lệnh bfloat16 native (AVX-512 BF16 hoặc AMX) không"""
+    return bool(cpu_flags() & BF16_CPU_FLAGS)
+
+
+def is_softmax_layer(layer):
+    """Layer trả về softmax (giữ float32 để xác suất chính xác)"""
+    if isinstance(layer, keras.layers.Softmax):
+        return True
+    activation = getattr(layer, 'activation', None)
+    return getattr(activation, '__name__', None) == 'softmax'
+
+
+def layer_dtype_policy(layer):
+    """Dtype policy cho từng layer khi chuyển sang bfloat16"""
+    if is_softmax_layer(layer):
+        return 'float32'
+    if isinstance(layer, NORMALIZATION_LAYERS):
+        return 'mixed_bfloat16'
+    return 'bfloat16'
+
+
+def _clone_layer_bfloat16(layer):
+    config = layer.get_config()
+    config['dtype'] = layer_dtype_policy(layer)
+    return layer.__class__.from_config(config)
+
+
+def to_bfloat16(model):
+    """
+    Tạo bản sao bfloat16 của model (cùng kiến trúc, weights được cast)
+
+    Args:
+        model: keras.Model (Functional/Sequential) float32
+
+    Returns:
+        keras.Model: Output softmax vẫn là float32
+    """
+    clone = keras.models.clone_model(model, clone_function=_clone_layer_bfloat16, recursive=True)
+    clone.set_weights(model.get_weights())
+    return clone
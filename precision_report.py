@@ -0,0 +1,96 @@
+"""
+Báo cáo sai lệch xác suất giữa inference bfloat16 và float32 trên tập ảnh validation
+
+Cách dùng:
+    python precision_report.py --images data/val
+    python precision_report.py --images data/val --resnet --limit 200 --json drift.json
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from app_keras3 import (BF16_SUPPORTED, RESNET50_MODEL_NAME, build_predict_fns, get_ensemble,
+                        load_image_array, model_registry)
+from distill import list_images
+
+
+def predict_model_set(model_set, precision, paths, batch_size):
+    """
+    Xác suất trung bình của ModelSet cho các ảnh (ensemble: trung bình các model, float)
+    Input là batch uint8, preprocess nằm trong graph model
+
+    Returns:
+        tuple: (probs (N, num_classes), thời gian ms/ảnh)
+    """
+    predict_fns = build_predict_fns(model_set, precision)
+    dummy = np.zeros((1, 224, 224, 3), dtype=np.uint8)
+    for predict_fn in predict_fns:
+        predict_fn(dummy)
+
+    probs = []
+    elapsed = 0.0
+    for start in range(0, len(paths), batch_size):
+        batch = np.stack([load_image_array(path) for path in paths[start:start + batch_size]])
+
+        t0 = time.perf_counter()
+        batch_probs = np.mean(
+            [np.asarray(predict_fn(batch), dtype=np.float32) for predict_fn in predict_fns], axis=0)
+        elapsed += time.perf_counter() - t0
+        probs.append(batch_probs)
+
+    return np.concatenate(probs, axis=0), elapsed / len(paths) * 1000
+
+
+def drift_report(model_set, paths, batch_size):
+    """So sánh bfloat16 với float32 cho một ModelSet"""
+    fp32, fp32_ms = predict_model_set(model_set, 'float32', paths, batch_size)
+    bf16, bf16_ms = predict_model_set(model_set, 'bfloat16', paths, batch_size)
+
+    # Sai lệch tính theo điểm phần trăm (giống confidence hiển thị trong app)
+    diff = np.abs(fp32 - bf16) * 100
+    return {
+        'versions': list(model_set.versions),
+        'num_images': len(paths),
+        'argmax_agreement': float(np.mean(fp32.argmax(axis=1) == bf16.argmax(axis=1))),
+        'mean_abs_drift_pct': float(diff.mean()),
+        'p99_abs_drift_pct': float(np.percentile(diff, 99)),
+        'max_abs_drift_pct': float(diff.max()),
+        'latency_ms_per_image': {'float32': fp32_ms, 'bfloat16': bf16_ms,
+                                 'speedup': fp32_ms / bf16_ms}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sai lệch xác suất bfloat16 so với float32')
+    parser.add_argument('--images', required=True, help='Thư mục ảnh validation')
+    parser.add_argument('--limit', type=int, default=0, help='Số ảnh tối đa (0 = tất cả)')
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--resnet', action='store_true', help='Đánh giá thêm ResNet50')
+    parser.add_argument('--json', help='Lưu báo cáo ra file JSON')
+    args = parser.parse_args()
+
+    paths = list_images(args.images)
+    if args.limit:
+        paths = paths[:args.limit]
+    if not paths:
+        raise SystemExit(f"Không có ảnh trong {args.images}")
+
+    if not BF16_SUPPORTED:
+        print("⚠ CPU không hỗ trợ bfloat16 native - bfloat16 được giả lập, thời gian không đại diện")
+
+    report = {'bf16_supported': BF16_SUPPORTED,
+              'cbam_ensemble': drift_report(get_ensemble(), paths, args.batch_size)}
+    if args.resnet:
+        report['resnet50'] = drift_report(model_registry.get(RESNET50_MODEL_NAME),
+                                          paths, args.batch_size)
+
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
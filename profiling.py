@@ -0,0 +1,169 @@
+"""
+Profiling theo yêu cầu cho N request tiếp theo (bật qua endpoint admin, không cần redeploy)
+- cProfile của toàn bộ handler (bao gồm image_analyzer khi CV stage chạy trực tiếp trong request)
+- Trace TensorFlow profiler của các lần forward (xem bằng TensorBoard)
+- Mỗi request một thư mục: profile.prof (pstats), summary.txt, summary.json (hot spots)
+Khi tắt, chi phí mỗi request chỉ là một phép so sánh
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+import metrics
+
+
+TOP_N = 30
+MAX_SUMMARIES = 50
+
+
+def hot_spots(stats, limit=TOP_N, filename_suffix=None):
+    """
+    Các hàm tốn thời gian nhất (theo tottime)
+
+    Returns:
+        list[dict]: function, calls, tottime_ms, cumtime_ms
+    """
+    rows = []
+    for (filename, line, name), (_, calls, tottime, cumtime, _) in stats.stats.items():
+        if filename_suffix and not filename.endswith(filename_suffix):
+            continue
+        rows.append({
+            'function': f'{os.path.basename(filename)}:{line}({name})',
+            'calls': calls,
+            'tottime_ms': tottime * 1000,
+            'cumtime_ms': cumtime * 1000
+        })
+    rows.sort(key=lambda row: row['tottime_ms'], reverse=True)
+    return rows[:limit]
+
+
+def write_summary(profile, run_dir, label, elapsed_ms, tf_trace):
+    """Lưu profile và tóm tắt hot spots vào run_dir"""
+    profile.dump_stats(os.path.join(run_dir, 'profile.prof'))
+
+    text = io.StringIO()
+    stats = pstats.Stats(profile, stream=text)
+    stats.sort_stats('cumulative').print_stats(TOP_N)
+    stats.sort_stats('tottime').print_stats(TOP_N)
+    with open(os.path.join(run_dir, 'summary.txt'), 'w', encoding='utf-8') as f:
+        f.write(f"{label} - {elapsed_ms:.1f} ms\n\n")
+        f.write(text.getvalue())
+
+    summary = {
+        'label': label,
+        'dir': run_dir,
+        'time': time.time(),
+        'elapsed_ms': elapsed_ms,
+        'tf_trace': tf_trace,
+        'hot_spots': hot_spots(stats),
+        'image_analyzer': hot_spots(stats, limit=10, filename_suffix='image_analyzer.py')
+    }
+    with open(os.path.join(run_dir, 'summary.json'), 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+class RequestProfiler:
+    """
+    Profiling cho `remaining` request tiếp theo
+
+    Args:
+        output_dir: Thư mục lưu kết quả (mỗi request một thư mục con)
+    """
+
+    def __init__(self, output_dir='profiles'):
+        self.output_dir = output_dir
+        self.remaining = 0
+        self.trace_tf = True
+        self.completed = deque(maxlen=MAX_SUMMARIES)
+        self._lock = threading.Lock()
+        # Mỗi lúc chỉ profile một request (cProfile/TF profiler dùng trạng thái chung của process)
+        self._running = False
+
+    @property
+    def active(self):
+        return self.remaining > 0
+
+    def start(self, num_requests, trace_tf=True):
+        """Bật profiling cho num_requests request tiếp theo"""
+        with self._lock:
+            self.remaining = max(0, int(num_requests))
+            self.trace_tf = trace_tf
+        metrics.record_event('profiling_started', requests=self.remaining, trace_tf=trace_tf)
+
+    def stop(self):
+        with self._lock:
+            self.remaining = 0
+
+    def claim(self):
+        """Nhận một lượt profiling (False nếu đã hết hoặc đang profile request khác)"""
+        with self._lock:
+            if self.remaining <= 0 or self._running:
+                return False
+            self.remaining -= 1
+            self._running = True
+            return True
+
+    def status(self):
+        return {
+            'remaining': self.remaining,
+            'trace_tf': self.trace_tf,
+            'output_dir': os.path.abspath(self.output_dir),
+            'completed': list(self.completed)
+        }
+
+    @staticmethod
+    def _start_tf_trace(run_dir):
+        """Bắt đầu trace TensorFlow (False nếu không bật được)"""
+        try:
+            import tensorflow as tf
+            tf.profiler.experimental.start(
+                os.path.join(run_dir, 'tf'),
+                options=tf.profiler.experimental.ProfilerOptions(host_tracer_level=2))
+            return True
+        except Exception as e:
+            print(f"⚠ Không bật được TensorFlow profiler: {e}")
+            return False
+
+    @staticmethod
+    def _stop_tf_trace():
+        import tensorflow as tf
+        tf.profiler.experimental.stop()
+
+    @contextmanager
+    def profile(self, label):
+        """
+        Profile một request (sau khi claim() thành công)
+
+        Yields:
+            str: Thư mục lưu kết quả của request
+        """
+        try:
+            run_dir = os.path.join(self.output_dir,
+                                   f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}")
+            os.makedirs(run_dir, exist_ok=True)
+
+            tf_trace = self.trace_tf and self._start_tf_trace(run_dir)
+            profile = cProfile.Profile()
+            start = time.perf_counter()
+            profile.enable()
+            try:
+                yield run_dir
+            finally:
+                profile.disable()
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                if tf_trace:
+                    self._stop_tf_trace()
+                summary = write_summary(profile, run_dir, label, elapsed_ms, tf_trace)
+                self.completed.append(summary)
+                metrics.record_event('profile_saved', dir=run_dir, elapsed_ms=elapsed_ms)
+        finally:
+            with self._lock:
+                self._running = False
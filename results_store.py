@@ -0,0 +1,207 @@
+"""
+Lưu trữ kết quả phân tích (SQLite) để tra cứu lịch sử và tái sử dụng kết quả
+cho ảnh đã phân tích trước đó (theo hash nội dung file)
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    image_hash TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    filename TEXT,
+    model_name TEXT NOT NULL,
+    model_versions TEXT NOT NULL,
+    predicted_class TEXT NOT NULL,
+    confidence REAL NOT NULL,
+    probabilities TEXT NOT NULL,
+    severity_score REAL,
+    severity_level TEXT,
+    image_features TEXT,
+    tta_views INTEGER NOT NULL DEFAULT 0,
+    perceptual_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_results_image_hash ON results (image_hash, created_at);
+CREATE INDEX IF NOT EXISTS idx_results_created_at ON results (created_at);
+CREATE INDEX IF NOT EXISTS idx_results_predicted_class ON results (predicted_class, created_at);
+"""
+
+# Cột được thêm sau phiên bản đầu tiên của schema (ALTER TABLE cho database cũ)
+ADDED_COLUMNS = {
+    'perceptual_hash': 'TEXT'
+}
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def compute_image_hash(img_path):
+    """SHA-256 của nội dung file ảnh"""
+    digest = hashlib.sha256()
+    with open(img_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResultsStore:
+    """
+    Kho kết quả SQLite (mỗi thread một connection, WAL mode cho đọc/ghi song song)
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(results)')}
+            for column, column_type in ADDED_COLUMNS.items():
+                if column not in columns:
+                    conn.execute(f'ALTER TABLE results ADD COLUMN {column} {column_type}')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def save_result(self, image_hash, result, model_name, model_versions, filename=None):
+        """
+        Lưu một kết quả dự đoán
+
+        Args:
+            image_hash: Hash nội dung ảnh (compute_image_hash)
+            result: dict từ predict_image (+ severity từ add_severity_analysis)
+            model_name: Tên model/ensemble (vd: 'cbam_ensemble')
+            model_versions: list phiên bản model đã dùng
+
+        Returns:
+            int: id của bản ghi
+        """
+        with self._connect() as conn:
+            cursor = conn.execute(
+                """
+                INSERT INTO results (image_hash, created_at, filename, model_name, model_versions,
+                                     predicted_class, confidence, probabilities,
+                                     severity_score, severity_level, image_features, tta_views,
+                                     perceptual_hash)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    image_hash,
+                    time.time(),
+                    filename,
+                    model_name,
+                    json.dumps(list(model_versions)),
+                    result['class'],
+                    result['confidence'],
+                    json.dumps(result['probabilities'], ensure_ascii=False),
+                    result.get('severity_score'),
+                    result.get('severity_level'),
+                    json.dumps(result.get('image_features')),
+                    result.get('tta_views', 0),
+                    result.get('perceptual_hash'),
+                )
+            )
+            return cursor.lastrowid
+
+    def find_latest(self, image_hash, model_name=None, model_versions=None):
+        """
+        Kết quả mới nhất của một ảnh (tùy chọn: khớp đúng model và phiên bản)
+
+        Returns:
+            dict hoặc None
+        """
+        sql = "SELECT * FROM results WHERE image_hash = ?"
+        params = [image_hash]
+        if model_name is not None:
+            sql += " AND model_name = ?"
+            params.append(model_name)
+        if model_versions is not None:
+            sql += " AND model_versions = ?"
+            params.append(json.dumps(list(model_versions)))
+        sql += " ORDER BY created_at DESC LIMIT 1"
+
+        row = self._connect().execute(sql, params).fetchone()
+        return row_to_dict(row) if row else None
+
+    def get_results(self, record_ids):
+        """Các bản ghi theo id (mới nhất trước)"""
+        if not record_ids:
+            return []
+        placeholders = ', '.join('?' * len(record_ids))
+        sql = f"SELECT * FROM results WHERE id IN ({placeholders}) ORDER BY created_at DESC"
+        return [row_to_dict(row) for row in self._connect().execute(sql, list(record_ids))]
+
+    def perceptual_hashes(self, after_id=0):
+        """
+        (id, perceptual_hash) của các bản ghi có id > after_id (dùng cho NearDuplicateIndex)
+        """
+        sql = ("SELECT id, perceptual_hash FROM results "
+               "WHERE id > ? AND perceptual_hash IS NOT NULL ORDER BY id")
+        return [(row['id'], row['perceptual_hash'])
+                for row in self._connect().execute(sql, (after_id,))]
+
+    def query_history(self, image_hash=None, predicted_class=None, since=None, until=None,
+                      limit=50, offset=0):
+        """
+        Tra cứu lịch sử (mới nhất trước)
+
+        Args:
+            image_hash: Lọc theo hash ảnh
+            predicted_class: Lọc theo class ('Caries', 'Fractured', 'Normal')
+            since, until: Khoảng thời gian (unix timestamp)
+            limit, offset: Phân trang
+
+        Returns:
+            list[dict]
+        """
+        sql = "SELECT * FROM results WHERE 1 = 1"
+        params = []
+        if image_hash:
+            sql += " AND image_hash = ?"
+            params.append(image_hash)
+        if predicted_class:
+            sql += " AND predicted_class = ?"
+            params.append(predicted_class)
+        if since is not None:
+            sql += " AND created_at >= ?"
+            params.append(since)
+        if until is not None:
+            sql += " AND created_at < ?"
+            params.append(until)
+        sql += " ORDER BY created_at DESC LIMIT ? OFFSET ?"
+        params.extend([int(limit), int(offset)])
+
+        return [row_to_dict(row) for row in self._connect().execute(sql, params)]
+
+    def class_counts(self, since=None, until=None):
+        """Số kết quả theo từng class (dùng cho thống kê)"""
+        sql = "SELECT predicted_class, COUNT(*) AS n FROM results WHERE 1 = 1"
+        params = []
+        if since is not None:
+            sql += " AND created_at >= ?"
+            params.append(since)
+        if until is not None:
+            sql += " AND created_at < ?"
+            params.append(until)
+        sql += " GROUP BY predicted_class"
+
+        return {row['predicted_class']: row['n'] for row in self._connect().execute(sql, params)}
+
+
+def row_to_dict(row):
+    """Chuyển một dòng SQLite thành dict (giải mã các cột JSON)"""
+    record = dict(row)
+    for key in ('model_versions', 'probabilities', 'image_features'):
+        if record.get(key) is not None:
+            record[key] = json.loads(record[key])
+    return record
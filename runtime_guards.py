@@ -0,0 +1,162 @@
+"""
+Giám sát tài nguyên của worker chạy lâu (RSS, file đang mở, số lần trace tf.function)
+- Khi RSS tăng quá ngưỡng so với lúc ổn định: xóa dữ liệu dẫn xuất của models, nếu vẫn cao thì recycle worker
+- Dọn thư mục uploads (theo tuổi file và số file tối đa)
+"""
+import os
+import resource
+import threading
+import time
+
+import metrics
+
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+KEEP_FILES = {'.gitkeep'}
+
+
+def rss_bytes():
+    """RSS hiện tại của process (bytes)"""
+    try:
+        with open('/proc/self/statm', encoding='ascii') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        # Không có /proc: ru_maxrss là RSS đỉnh (KB trên Linux)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def open_file_count():
+    """Số file descriptor đang mở (None nếu không đọc được)"""
+    try:
+        return len(os.listdir('/proc/self/fd'))
+    except OSError:
+        return None
+
+
+def tracing_count(obj):
+    """Số lần trace tf.function của CompiledPredictor hoặc predict function của keras.Model"""
+    if hasattr(obj, 'tracing_count'):
+        return obj.tracing_count()
+    get_count = getattr(getattr(obj, 'predict_function', None), 'experimental_get_tracing_count', None)
+    return get_count() if get_count else 0
+
+
+def prune_uploads(folder, max_age=0, max_files=0):
+    """
+    Xóa file upload cũ hơn max_age giây, sau đó chỉ giữ max_files file mới nhất (0 = không giới hạn)
+
+    Returns:
+        int: Số file đã xóa
+    """
+    try:
+        with os.scandir(folder) as it:
+            entries = list(it)
+    except OSError:
+        return 0
+
+    # Worker khác có thể xóa file cùng lúc -> stat một lần, bỏ qua file đã biến mất
+    files = []
+    for entry in entries:
+        if entry.name in KEEP_FILES:
+            continue
+        try:
+            if entry.is_file():
+                files.append((entry.stat().st_mtime, entry.path))
+        except OSError:
+            continue
+
+    files.sort(reverse=True)
+    now = time.time()
+    removed = 0
+    for i, (mtime, path) in enumerate(files):
+        too_old = max_age and now - mtime > max_age
+        too_many = max_files and i >= max_files
+        if too_old or too_many:
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+class ResourceGuard:
+    """
+    Kiểm tra tài nguyên sau mỗi `check_every` request
+
+    Args:
+        check_every: Chu kỳ kiểm tra (số request, 0 = tắt)
+        max_rss_growth: RSS tăng tối đa (bytes) so với mốc sau warmup (0 = không kiểm tra)
+        warmup_requests: Số request đầu bỏ qua (load model, biên dịch) trước khi lấy mốc RSS
+        clear_fn: () -> None, giải phóng trạng thái có thể tạo lại (vd: cache của models)
+        recycle_fn: () -> None, gọi khi RSS vẫn vượt ngưỡng sau clear_fn (None = chỉ cảnh báo)
+        tracing_fn: () -> int, tổng số lần trace hiện tại (tùy chọn, chỉ để theo dõi)
+        maintenance_fn: () -> None, việc định kỳ khác (vd: dọn uploads)
+    """
+
+    def __init__(self, check_every, max_rss_growth=0, warmup_requests=0, clear_fn=None,
+                 recycle_fn=None, tracing_fn=None, maintenance_fn=None):
+        self.check_every = check_every
+        self.max_rss_growth = max_rss_growth
+        self.warmup_requests = warmup_requests
+        self.clear_fn = clear_fn
+        self.recycle_fn = recycle_fn
+        self.tracing_fn = tracing_fn
+        self.maintenance_fn = maintenance_fn
+        self.requests = 0
+        self.baseline_rss = None
+        self.recycling = False
+        self._lock = threading.Lock()
+
+    def request_done(self):
+        """Gọi sau mỗi request được theo dõi"""
+        if not self.check_every:
+            return
+        with self._lock:
+            self.requests += 1
+            due = self.requests % self.check_every == 0
+        if due:
+            self.check()
+
+    def sample(self):
+        """Trạng thái tài nguyên hiện tại"""
+        return {
+            'requests': self.requests,
+            'rss_bytes': rss_bytes(),
+            'open_files': open_file_count(),
+            'tracing_count': self.tracing_fn() if self.tracing_fn else None
+        }
+
+    def check(self):
+        """Cập nhật metrics, chạy maintenance và xử lý khi RSS tăng quá ngưỡng"""
+        if self.maintenance_fn:
+            self.maintenance_fn()
+
+        sample = self.sample()
+        for key, value in sample.items():
+            metrics.set_gauge(f'resources.{key}', value)
+
+        if self.requests < self.warmup_requests or not self.max_rss_growth or self.recycling:
+            return
+        if self.baseline_rss is None:
+            self.baseline_rss = sample['rss_bytes']
+            metrics.set_gauge('resources.baseline_rss_bytes', self.baseline_rss)
+            return
+
+        growth = sample['rss_bytes'] - self.baseline_rss
+        metrics.set_gauge('resources.rss_growth_bytes', growth)
+        if growth <= self.max_rss_growth:
+            return
+
+        metrics.record_event('rss_growth', growth_bytes=growth, requests=self.requests)
+        if self.clear_fn:
+            self.clear_fn()
+            growth = rss_bytes() - self.baseline_rss
+            if growth <= self.max_rss_growth:
+                return
+
+        print(f"⚠ RSS tăng {growth / 1024 / 1024:.0f} MB sau {self.requests} request")
+        if self.recycle_fn:
+            self.recycling = True
+            metrics.record_event('worker_recycle', growth_bytes=growth, requests=self.requests)
+            self.recycle_fn()
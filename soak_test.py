@@ -0,0 +1,161 @@
+"""
+Soak test: chạy hàng nghìn request tổng hợp qua /predict (và /compare_models) bằng Flask test client,
+theo dõi RSS, số file đang mở, số lần trace tf.function và số file trong uploads theo thời gian.
+Thoát với mã 1 nếu mức tăng sau warmup vượt ngưỡng hoặc có request không trả 200.
+
+Cách dùng:
+    python soak_test.py --requests 2000
+    python soak_test.py --requests 5000 --compare-every 20 --max-rss-growth-mb 150 --json soak.json
+"""
+import os
+import tempfile
+
+# Kho kết quả tạm, không kiểm tra tài nguyên trong app (harness tự đo).
+# Tắt tìm ảnh gần trùng: các ảnh tổng hợp giống nhau về pHash, mọi request phải chạy CV stage + inference
+os.environ.setdefault('RESULTS_DB', os.path.join(tempfile.mkdtemp(prefix='soak-'), 'results.db'))
+os.environ.setdefault('NEAR_DUPLICATE_DISTANCE', '0')
+os.environ.setdefault('RESOURCE_CHECK_EVERY', '0')
+os.environ.setdefault('MODEL_WATCH_INTERVAL', '0')
+
+import argparse
+import io
+import json
+import time
+
+import cv2
+import numpy as np
+
+from app_keras3 import app, clean_uploads, get_ensemble, model_tracing_count
+from runtime_guards import open_file_count, rss_bytes
+
+
+def synthetic_xray(rng, size=(512, 768)):
+    """Ảnh xám giống X-quang (vùng sáng/tối mượt + nhiễu)"""
+    height, width = size
+    coarse = rng.integers(0, 255, (height // 32, width // 32), dtype=np.uint8)
+    img = cv2.resize(coarse, (width, height), interpolation=cv2.INTER_CUBIC) // 2
+    return img + rng.integers(0, 40, (height, width), dtype=np.uint8)
+
+
+def unique_png(img, step):
+    """
+    PNG của img với vài pixel mang số thứ tự request: mỗi request một hash SHA-256 khác
+    (không trúng cache kết quả), pHash gần như không đổi
+    """
+    img = img.copy()
+    img[0, :8] = np.frombuffer(step.to_bytes(8, 'big'), dtype=np.uint8)
+    ok, encoded = cv2.imencode('.png', img)
+    if not ok:
+        raise RuntimeError("Không encode được ảnh tổng hợp")
+    return encoded.tobytes()
+
+
+def count_uploads():
+    folder = app.config['UPLOAD_FOLDER']
+    return sum(1 for entry in os.scandir(folder) if entry.is_file())
+
+
+def sample(step, started):
+    return {
+        'request': step,
+        'elapsed_s': time.perf_counter() - started,
+        'rss_mb': rss_bytes() / 1024 / 1024,
+        'open_files': open_file_count(),
+        'tracing_count': model_tracing_count(),
+        'uploads': count_uploads()
+    }
+
+
+def post_image(client, path, data, filename):
+    response = client.post(path, data={'file': (io.BytesIO(data), filename)},
+                           content_type='multipart/form-data')
+    return response.status_code
+
+
+def check_growth(samples, warmup, args):
+    """
+    So sánh mẫu cuối với mốc sau warmup
+
+    Returns:
+        list[str]: Các ngưỡng bị vượt (rỗng = đạt)
+    """
+    baseline = next((s for s in samples if s['request'] >= warmup), samples[0])
+    last = samples[-1]
+    failures = []
+
+    rss_growth = last['rss_mb'] - baseline['rss_mb']
+    if rss_growth > args.max_rss_growth_mb:
+        failures.append(f"RSS tăng {rss_growth:.1f} MB > {args.max_rss_growth_mb} MB")
+    if last['open_files'] is not None and baseline['open_files'] is not None:
+        fd_growth = last['open_files'] - baseline['open_files']
+        if fd_growth > args.max_fd_growth:
+            failures.append(f"File đang mở tăng {fd_growth} > {args.max_fd_growth}")
+    retraces = last['tracing_count'] - baseline['tracing_count']
+    if retraces > args.max_retraces:
+        failures.append(f"tf.function trace thêm {retraces} lần > {args.max_retraces}")
+    if args.max_uploads and last['uploads'] > args.max_uploads:
+        failures.append(f"uploads có {last['uploads']} file > {args.max_uploads}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Soak test bộ nhớ/tài nguyên của app')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--warmup', type=int, default=50, help='Số request đầu không tính vào mốc')
+    parser.add_argument('--sample-every', type=int, default=50)
+    parser.add_argument('--compare-every', type=int, default=0,
+                        help='Mỗi N request gửi thêm /compare_models (cần best_resnet50.h5, 0 = tắt)')
+    parser.add_argument('--base-images', type=int, default=20,
+                        help='Số ảnh nền tổng hợp (mỗi request vẫn là một file khác, không trúng cache)')
+    parser.add_argument('--max-rss-growth-mb', type=float, default=200)
+    parser.add_argument('--max-fd-growth', type=int, default=20)
+    parser.add_argument('--max-retraces', type=int, default=0)
+    parser.add_argument('--max-uploads', type=int, default=0,
+                        help='Số file tối đa trong uploads khi kết thúc (0 = không kiểm tra)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='Lưu các mẫu đo ra file JSON')
+    args = parser.parse_args()
+
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    get_ensemble()
+    rng = np.random.default_rng(args.seed)
+    images = [synthetic_xray(rng) for _ in range(args.base_images)]
+    client = app.test_client()
+
+    statuses = {}
+    samples = []
+    started = time.perf_counter()
+    for step in range(1, args.requests + 1):
+        data = unique_png(images[step % len(images)], step)
+        status = post_image(client, '/predict', data, f'soak_{step}.png')
+        statuses[status] = statuses.get(status, 0) + 1
+        if args.compare_every and step % args.compare_every == 0:
+            status = post_image(client, '/compare_models', data, f'soak_{step}.png')
+            statuses[status] = statuses.get(status, 0) + 1
+
+        if step % args.sample_every == 0 or step == args.requests:
+            clean_uploads()
+            samples.append(sample(step, started))
+            s = samples[-1]
+            print(f"{step:>6} req  {s['elapsed_s']:>7.0f}s  RSS {s['rss_mb']:>8.1f} MB  "
+                  f"fds {s['open_files']}  traces {s['tracing_count']}  uploads {s['uploads']}")
+
+    failures = check_growth(samples, args.warmup, args)
+    # Redirect (302) = lỗi được flash, request không chạy hết CV stage + inference
+    errors = {status: count for status, count in statuses.items() if status != 200}
+    if errors:
+        failures.append(f"Có request không thành công (HTTP status: số request): {errors}")
+    report = {'statuses': statuses, 'samples': samples, 'failures': failures}
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    print(f"\nHTTP status: {statuses}")
+    if failures:
+        print("❌ " + "\n❌ ".join(failures))
+        raise SystemExit(1)
+    print("✓ Không phát hiện tăng trưởng tài nguyên vượt ngưỡng")
+
+
+if __name__ == '__main__':
+    main()
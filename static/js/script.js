@@ -56,6 +56,13 @@ document.addEventListener('DOMContentLoaded', function() {
             submitBtn.disabled = true;
             submitBtn.innerHTML = '<span class="btn-icon">⏳</span> Đang phân tích...';
             submitBtn.style.opacity = '0.7';
+
+            // Streaming mode: hiển thị tiến độ từng model thay vì chờ toàn bộ kết quả
+            const streamUrl = uploadForm.dataset.streamUrl;
+            if (streamUrl && window.fetch && window.ReadableStream && window.TextDecoder) {
+                e.preventDefault();
+                streamPrediction(streamUrl, new FormData(uploadForm), submitBtn);
+            }
         });
     }
 
@@ -105,6 +112,80 @@ document.addEventListener('DOMContentLoaded', function() {
     }
 });
 
+// Đọc kết quả streaming (server-sent events) từ /predict?stream=1
+function streamPrediction(url, formData, submitBtn) {
+    const setStatus = function(text) {
+        submitBtn.innerHTML = '<span class="btn-icon">⏳</span> ' + text;
+    };
+
+    const handleEvent = function(event, data) {
+        if (event === 'validity') {
+            setStatus(data.is_valid ? 'Ảnh hợp lệ, đang chạy models...' : 'Ảnh không hợp lệ');
+        } else if (event === 'model') {
+            const pred = data.prediction;
+            setStatus('Model ' + data.version + ' (' + data.completed + '/' + data.total + '): ' +
+                      pred.class_vn + ' ' + pred.confidence.toFixed(1) + '%');
+        } else if (event === 'tiles') {
+            setStatus(data.count + ' vùng: ' + data.prediction.class_vn + ' ' +
+                      data.prediction.confidence.toFixed(1) + '%');
+        } else if (event === 'tta') {
+            setStatus('TTA (' + data.views + ' biến thể): ' + data.prediction.class_vn + ' ' +
+                      data.prediction.confidence.toFixed(1) + '%');
+        } else if (event === 'result') {
+            setStatus('Đang đánh giá mức độ nghiêm trọng...');
+        } else if (event === 'done') {
+            document.open();
+            document.write(data.html);
+            document.close();
+        } else if (event === 'error') {
+            alert(data.message);
+            window.location.reload();
+        }
+    };
+
+    fetch(url, { method: 'POST', body: formData }).then(function(response) {
+        const contentType = response.headers.get('Content-Type') || '';
+        if (contentType.indexOf('text/event-stream') === -1) {
+            // Server trả về redirect/HTML (vd: lỗi validate) - hiển thị như bình thường
+            return response.text().then(function(html) {
+                document.open();
+                document.write(html);
+                document.close();
+            });
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+
+        const pump = function() {
+            return reader.read().then(function(chunk) {
+                if (chunk.done) return;
+                buffer += decoder.decode(chunk.value, { stream: true });
+
+                let sep;
+                while ((sep = buffer.indexOf('\n\n')) !== -1) {
+                    const raw = buffer.slice(0, sep);
+                    buffer = buffer.slice(sep + 2);
+
+                    let event = 'message';
+                    let data = '';
+                    raw.split('\n').forEach(function(line) {
+                        if (line.indexOf('event: ') === 0) event = line.slice(7);
+                        else if (line.indexOf('data: ') === 0) data += line.slice(6);
+                    });
+                    handleEvent(event, JSON.parse(data));
+                }
+                return pump();
+            });
+        };
+        return pump();
+    }).catch(function() {
+        alert('Lỗi kết nối tới server');
+        window.location.reload();
+    });
+}
+
 // Reset form function
 function resetForm() {
     const uploadArea = document.getElementById('uploadArea');
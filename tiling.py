@@ -0,0 +1,113 @@
+"""
+Chia ảnh X-quang toàn cảnh (panoramic) độ phân giải cao thành các tile 224x224 chồng lấn
+để chạy ensemble theo batch; kết luận cả ảnh lấy từ view toàn cục, các tile chỉ dùng cho bản đồ theo vùng
+"""
+import math
+
+import cv2
+import numpy as np
+from PIL import Image
+
+
+TILE_SIZE = 224
+
+
+def image_size(img_path):
+    """Kích thước ảnh (height, width) - chỉ đọc header, không decode"""
+    with Image.open(img_path) as img:
+        width, height = img.size
+    return height, width
+
+
+def load_rgb(img_path):
+    """Decode ảnh ở độ phân giải gốc thành mảng RGB uint8 (H, W, 3)"""
+    with Image.open(img_path) as img:
+        return np.asarray(img.convert('RGB'))
+
+
+def axis_positions(length, tile, stride):
+    """Vị trí bắt đầu các tile trên một trục (tile cuối luôn chạm mép ảnh)"""
+    if length <= tile:
+        return [0]
+    positions = list(range(0, length - tile + 1, stride))
+    if positions[-1] != length - tile:
+        positions.append(length - tile)
+    return positions
+
+
+def plan_tiles(height, width, max_tiles, tile=TILE_SIZE, overlap=0.25):
+    """
+    Lên kế hoạch chia tile, thu nhỏ ảnh nếu số tile vượt max_tiles
+
+    Args:
+        height, width: Kích thước ảnh gốc
+        max_tiles: Số tile tối đa (theo ngân sách độ trễ)
+        overlap: Tỷ lệ chồng lấn giữa 2 tile liền kề (0-0.9)
+
+    Returns:
+        tuple: (scale, boxes, stride)
+            - scale: Hệ số thu nhỏ áp dụng lên ảnh trước khi cắt tile (<= 1)
+            - boxes: list (y, x) góc trên-trái của tile trong ảnh đã thu nhỏ
+            - stride: Bước nhảy giữa các tile (pixel, ảnh đã thu nhỏ)
+    """
+    stride = max(1, int(tile * (1 - overlap)))
+    max_tiles = max(1, int(max_tiles))
+
+    scale = 1.0
+    while True:
+        scaled_h = max(tile, int(round(height * scale)))
+        scaled_w = max(tile, int(round(width * scale)))
+        ys = axis_positions(scaled_h, tile, stride)
+        xs = axis_positions(scaled_w, tile, stride)
+        if len(ys) * len(xs) <= max_tiles or (len(ys) == 1 and len(xs) == 1):
+            break
+        # Thu nhỏ theo tỷ lệ căn bậc hai số tile dư (số tile ~ diện tích)
+        scale *= max(0.5, min(0.95, math.sqrt(max_tiles / (len(ys) * len(xs)))))
+
+    boxes = [(y, x) for y in ys for x in xs]
+    return scale, boxes, stride
+
+
+def extract_tiles(img, scale, boxes, tile=TILE_SIZE):
+    """
+    Cắt các tile từ ảnh RGB
+
+    Args:
+        img: np.ndarray uint8 (H, W, 3)
+        scale: Hệ số thu nhỏ từ plan_tiles
+
+    Returns:
+        np.ndarray uint8 (N, tile, tile, 3)
+    """
+    height, width = img.shape[:2]
+    scaled_h = max(tile, int(round(height * scale)))
+    scaled_w = max(tile, int(round(width * scale)))
+    if (scaled_h, scaled_w) != (height, width):
+        img = cv2.resize(img, (scaled_w, scaled_h), interpolation=cv2.INTER_AREA)
+
+    tiles = np.empty((len(boxes), tile, tile, 3), dtype=np.uint8)
+    for i, (y, x) in enumerate(boxes):
+        tiles[i] = img[y:y + tile, x:x + tile]
+    return tiles
+
+
+def probability_map(tile_probs, boxes, stride, tile=TILE_SIZE):
+    """
+    Bản đồ xác suất theo lưới ô kích thước `stride` (trung bình các tile phủ lên mỗi ô)
+
+    Returns:
+        np.ndarray (rows, cols, num_classes)
+    """
+    tile_probs = np.asarray(tile_probs, dtype=np.float64)
+    rows = max(y for y, _ in boxes) // stride + math.ceil(tile / stride)
+    cols = max(x for _, x in boxes) // stride + math.ceil(tile / stride)
+    cells = math.ceil(tile / stride)
+
+    total = np.zeros((rows, cols, tile_probs.shape[1]))
+    count = np.zeros((rows, cols, 1))
+    for probs, (y, x) in zip(tile_probs, boxes):
+        r, c = y // stride, x // stride
+        total[r:r + cells, c:c + cells] += probs
+        count[r:r + cells, c:c + cells] += 1
+
+    return total / np.maximum(count, 1)
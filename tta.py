@@ -0,0 +1,97 @@
+"""
+Test-time augmentation (TTA) cho ảnh X-quang răng
+Tạo nhiều biến thể của cùng một ảnh (lật, xoay nhẹ, thay đổi tương phản)
+và gộp thành một batch để chạy qua ensemble trong một lần forward
+"""
+import cv2
+import numpy as np
+
+
+# Danh sách biến thể theo thứ tự ưu tiên - view đầu tiên luôn là ảnh gốc
+TTA_TRANSFORMS = [
+    ('identity', {}),
+    ('hflip', {}),
+    ('rotate', {'angle': 5}),
+    ('rotate', {'angle': -5}),
+    ('contrast', {'factor': 1.15}),
+    ('contrast', {'factor': 0.85}),
+    ('hflip_rotate', {'angle': 5}),
+    ('hflip_rotate', {'angle': -5}),
+]
+
+MAX_TTA_VIEWS = len(TTA_TRANSFORMS)
+
+
+def rotate_image(img, angle):
+    """Xoay ảnh quanh tâm, giữ nguyên kích thước (viền được phản chiếu)"""
+    h, w = img.shape[:2]
+    matrix = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+    return cv2.warpAffine(img, matrix, (w, h),
+                          flags=cv2.INTER_LINEAR,
+                          borderMode=cv2.BORDER_REFLECT_101)
+
+
+def adjust_contrast(img, factor):
+    """Thay đổi độ tương phản quanh giá trị trung bình của ảnh"""
+    mean = img.mean()
+    return np.clip((img - mean) * factor + mean, 0, 255)
+
+
+def apply_transform(img, name, params):
+    """
+    Áp dụng một biến thể lên ảnh
+
+    Args:
+        img: Ảnh float32 (H, W, 3), giá trị 0-255 (chưa preprocess_input)
+        name: Tên biến thể trong TTA_TRANSFORMS
+        params: Tham số của biến thể
+
+    Returns:
+        np.ndarray: Ảnh float32 (H, W, 3)
+    """
+    if name == 'identity':
+        return img
+    if name == 'hflip':
+        return img[:, ::-1, :]
+    if name == 'rotate':
+        return rotate_image(img, params['angle'])
+    if name == 'contrast':
+        return adjust_contrast(img, params['factor'])
+    if name == 'hflip_rotate':
+        return rotate_image(np.ascontiguousarray(img[:, ::-1, :]), params['angle'])
+    raise ValueError(f"Biến thể TTA không hợp lệ: {name}")
+
+
+def build_tta_batch(img, num_views):
+    """
+    Tạo batch các biến thể của ảnh
+
+    Args:
+        img: Ảnh (H, W, 3) hoặc (1, H, W, 3), giá trị 0-255
+        num_views: Số biến thể (bao gồm ảnh gốc), tối đa MAX_TTA_VIEWS
+
+    Returns:
+        np.ndarray: Batch uint8 (num_views, H, W, 3) - preprocess nằm trong graph model
+    """
+    if img.ndim == 4:
+        img = img[0]
+    img = img.astype(np.float32)
+    num_views = max(1, min(int(num_views), MAX_TTA_VIEWS))
+
+    batch = np.empty((num_views,) + img.shape, dtype=np.uint8)
+    for i, (name, params) in enumerate(TTA_TRANSFORMS[:num_views]):
+        batch[i] = np.clip(np.rint(apply_transform(img, name, params)), 0, 255)
+    return batch
+
+
+def aggregate_tta_probs(probs):
+    """
+    Gộp xác suất của các biến thể (trung bình)
+
+    Args:
+        probs: np.ndarray (num_views, num_classes)
+
+    Returns:
+        np.ndarray: (num_classes,)
+    """
+    return np.asarray(probs, dtype=np.float64).mean(axis=0)